@@ -0,0 +1,433 @@
+"""
+    asyncio client with the ftpretty interface
+
+    Control and data connections are asyncio streams, so one process can run
+    many transfers at once, each on its own connection, without threads.
+    Needs python 3.5+, connects in passive mode (EPSV, or PASV) without TLS.
+
+    async with AsyncFtpretty(host, user, password) as f:
+        await f.put('/tmp/data.txt', 'remote/data.txt')
+        contents = await f.get('remote/data.txt')
+
+"""
+import asyncio
+from ftplib import error_perm, error_proto, error_reply, error_temp, parse227, parse229, parse257
+import io
+import os
+import posixpath
+
+from ftpretty import split_file_info
+
+
+class AsyncFtpretty(object):
+    """ An asyncio FTP session
+
+        Commands on one session run one at a time, open more sessions (or
+        pass workers to the tree calls) for concurrent transfers.
+    """
+    encoding = 'utf-8'
+    blocksize = 65536
+    relative_paths = set(['.', '..'])
+
+    def __init__(self, host, user, password, port=21, timeout=None, blocksize=None):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+        if blocksize is not None:
+            self.blocksize = blocksize
+        self.known_dirs = set()
+        self._reader = self._writer = None
+        self._lock = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        """ Open the control connection and log in """
+        self._reader, self._writer = await self._wait(
+            asyncio.open_connection(self.host, self.port))
+        self._lock = asyncio.Lock()
+        async with self._lock:
+            resp = await self._getresp()
+            if resp[0] != '2':
+                raise error_reply(resp)
+            resp = await self._command('USER %s' % self.user)
+            if resp[0] == '3':
+                resp = await self._command('PASS %s' % self.password)
+            if resp[0] != '2':
+                raise error_reply(resp)
+        return self
+
+    def clone(self):
+        """ A new, not yet connected, session with the same settings """
+        return AsyncFtpretty(self.host, self.user, self.password, port=self.port,
+                             timeout=self.timeout, blocksize=self.blocksize)
+
+    async def sendcmd(self, cmd):
+        """ Send a command and return the reply, like FTP.sendcmd """
+        async with self._lock:
+            return await self._command(cmd)
+
+    async def voidcmd(self, cmd):
+        """ Send a command, raising error_reply unless the reply is 2xx """
+        async with self._lock:
+            return await self._voidcmd(cmd)
+
+    async def get(self, remote, local=None):
+        """ Gets the file from FTP server
+
+            local can be:
+                a file: opened for writing, left open
+                a string: path to output file
+                None: contents are returned as bytes
+        """
+        if isinstance(local, str):
+            local_file = open(local, 'wb')
+        elif local is None:
+            local_file = io.BytesIO()
+        else:
+            local_file = local
+        try:
+            async with self._lock:
+                await self._voidcmd('TYPE I')
+                reader, writer = await self._open_data('RETR %s' % remote)
+                try:
+                    while True:
+                        data = await self._wait(reader.read(self.blocksize))
+                        if not data:
+                            break
+                        local_file.write(data)
+                finally:
+                    writer.close()
+                await self._voidresp()
+            if local is None:
+                return local_file.getvalue()
+        finally:
+            if local is None or isinstance(local, str):
+                local_file.close()
+        return None
+
+    async def put(self, local, remote, contents=None):
+        """ Puts a local file (or contents) on to the FTP server
+
+            local can be a path, anything with read(), or None when contents
+            (bytes or anything with read()) are pushed. Missing remote
+            directories are created and the size reported by SIZE is returned.
+        """
+        if remote.endswith('/'):
+            remote += os.path.basename(local)
+        if contents is not None:
+            local_file = contents if hasattr(contents, 'read') else io.BytesIO(contents)
+        elif hasattr(local, 'read'):
+            local_file = local
+        else:
+            local_file = open(local, 'rb')
+
+        remote_dir = posixpath.dirname(remote)
+        try:
+            if remote_dir:
+                await self.makedirs(remote_dir)
+            async with self._lock:
+                await self._voidcmd('TYPE I')
+                reader, writer = await self._open_data('STOR %s' % remote)
+                try:
+                    while True:
+                        data = local_file.read(self.blocksize)
+                        if not data:
+                            break
+                        writer.write(data)
+                        await self._wait(writer.drain())
+                finally:
+                    writer.close()
+                await self._voidresp()
+                return int((await self._voidcmd('SIZE %s' % remote))[3:].strip())
+        finally:
+            local_file.close()
+
+    async def list(self, remote='.', extra=False, remove_relative_paths=False):
+        """ Return directory list, parsed LIST entries with extra=True """
+        lines = await self._lines(('LIST %s' if extra else 'NLST %s') % remote)
+        directory_list = split_file_info(lines) if extra else lines
+        if remove_relative_paths:
+            return [entry for entry in directory_list if self.is_not_relative_path(entry)]
+        return directory_list
+
+    def is_not_relative_path(self, path):
+        if hasattr(path, 'get'):
+            return path.get('name') not in self.relative_paths
+        return path not in self.relative_paths
+
+    async def size(self, remote):
+        """ Size of a remote file from SIZE """
+        return int((await self.voidcmd('SIZE %s' % remote))[3:].strip())
+
+    async def pwd(self):
+        """ Return the current working directory """
+        return parse257(await self.voidcmd('PWD'))
+
+    async def cd(self, remote):
+        """ Change working directory on server, False if it failed """
+        try:
+            await self.voidcmd('CWD %s' % remote)
+        except (error_perm, error_reply):
+            return False
+        self.known_dirs = set(d for d in self.known_dirs if d.startswith('/'))
+        return await self.pwd()
+
+    async def mkdir(self, new_dir):
+        """ Create directory on the server """
+        result = parse257(await self.voidcmd('MKD %s' % new_dir))
+        self.known_dirs.add(posixpath.normpath(new_dir))
+        return result
+
+    async def makedirs(self, remote):
+        """ Create a remote directory and any missing parents, see ftpretty.makedirs """
+        remote = posixpath.normpath(remote.replace('\\', '/'))
+        missing = []
+        path = remote
+        while path not in self.known_dirs and posixpath.basename(path) not in ('', '.', '..'):
+            missing.append(path)
+            path = posixpath.dirname(path)
+        for path in reversed(missing):
+            try:
+                await self.voidcmd('MKD %s' % path)
+            except error_perm:
+                pass
+            self.known_dirs.add(path)
+        return remote
+
+    async def delete(self, remote):
+        """ Delete a file, or an empty directory, from server """
+        try:
+            await self.voidcmd('DELE %s' % remote)
+        except (error_perm, error_reply):
+            try:
+                await self.voidcmd('RMD %s' % remote)
+                self.known_dirs.clear()
+            except (error_perm, error_reply):
+                return False
+        return True
+
+    async def rename(self, remote_from, remote_to):
+        """ Rename a file on the server """
+        self.known_dirs.clear()
+        async with self._lock:
+            resp = await self._command('RNFR %s' % remote_from)
+            if resp[0] != '3':
+                raise error_reply(resp)
+            return await self._voidcmd('RNTO %s' % remote_to)
+
+    async def get_tree(self, remote, local, workers=1):
+        """ Recursively download a directory tree
+
+            Directories are listed and files downloaded on workers sessions
+            (this one and workers - 1 new ones). A failure doesn't stop the
+            tree, a list of (remote, local, error) tuples is returned.
+        """
+        async def handler(ftp, task):
+            kind, remote_path, local_path = task
+            if kind == 'get':
+                await ftp.get(remote_path, local_path)
+                return []
+            if not os.path.isdir(local_path):
+                os.mkdir(local_path)
+            found = []
+            for entry in await ftp.list(remote_path, extra=True):
+                name = entry['name']
+                if name in self.relative_paths:
+                    continue
+                remote_child = posixpath.join(remote_path, name)
+                local_child = os.path.join(local_path, name)
+                if entry.flags == 'd':
+                    found.append(('list', remote_child, local_child))
+                elif entry.flags == '-':
+                    found.append(('get', remote_child, local_child))
+            return found
+
+        remote = remote.replace('\\', '/')
+        errors = await self._run([('list', remote, local)], workers, handler)
+        return [(task[1], task[2], str(why)) for task, why in errors]
+
+    async def upload_tree(self, src, dst, ignore=None, workers=1):
+        """ Recursively upload a directory tree, without following symlinks
+
+            The remote directories are created first, then the files are
+            stored on workers sessions. A list of (src, dst, error) tuples is
+            returned for the files that failed.
+        """
+        dst = dst.replace('\\', '/')
+        dirs, files = [dst], []
+        pending = [(src, dst)]
+        while pending:
+            src_dir, dst_dir = pending.pop()
+            names = os.listdir(src_dir)
+            ignored_names = ignore(src_dir, names) if ignore is not None else set()
+            for name in names:
+                if name in ignored_names:
+                    continue
+                src_name = os.path.join(src_dir, name)
+                dst_name = posixpath.join(dst_dir, name)
+                if os.path.islink(src_name):
+                    continue
+                elif os.path.isdir(src_name):
+                    dirs.append(dst_name)
+                    pending.append((src_name, dst_name))
+                else:
+                    files.append((src_name, dst_name))
+
+        for remote_dir in dirs:
+            await self.makedirs(remote_dir)
+
+        async def handler(ftp, task):
+            ftp.known_dirs.update(dirs)
+            await ftp.put(task[0], task[1])
+            return []
+
+        errors = await self._run(files, workers, handler)
+        return [(task[0], task[1], str(why)) for task, why in errors]
+
+    async def close(self):
+        """ End the session """
+        if self._writer is None:
+            return
+        try:
+            await self.sendcmd('QUIT')
+        except Exception:
+            pass
+        self._writer.close()
+        self._writer = self._reader = None
+
+    async def _run(self, tasks, workers, handler):
+        """ Run tasks on workers sessions, handler returns follow-up tasks
+
+            Returns the (task, exception) pairs of the tasks that failed.
+        """
+        queue = asyncio.Queue()
+        for task in tasks:
+            queue.put_nowait(task)
+        errors = []
+        sessions = [self]
+        try:
+            for _ in range(max(1, workers) - 1):
+                sessions.append(await self.clone().connect())
+        except Exception:
+            for ftp in sessions[1:]:
+                await ftp.close()
+            raise
+
+        async def work(ftp):
+            while True:
+                task = await queue.get()
+                try:
+                    for follow_up in await handler(ftp, task):
+                        queue.put_nowait(follow_up)
+                except Exception as why:
+                    errors.append((task, why))
+                finally:
+                    queue.task_done()
+
+        runners = [asyncio.ensure_future(work(ftp)) for ftp in sessions]
+        try:
+            await queue.join()
+        finally:
+            for runner in runners:
+                runner.cancel()
+            await asyncio.gather(*runners, return_exceptions=True)
+            for ftp in sessions[1:]:
+                await ftp.close()
+        return errors
+
+    async def _lines(self, cmd):
+        """ Run a text transfer and return its lines """
+        async with self._lock:
+            await self._voidcmd('TYPE A')
+            reader, writer = await self._open_data(cmd)
+            lines = []
+            try:
+                while True:
+                    line = await self._wait(reader.readline())
+                    if not line:
+                        break
+                    lines.append(line.decode(self.encoding).rstrip('\r\n'))
+            finally:
+                writer.close()
+            await self._voidresp()
+        return lines
+
+    async def _open_data(self, cmd, rest=None):
+        """ Open a passive data connection and send cmd on it, lock held """
+        try:
+            resp = await self._command('EPSV')
+            host, port = parse229(resp, self._writer.get_extra_info('peername'))
+        except error_perm:
+            # like ftplib, the address in the reply is not trusted
+            host = self._writer.get_extra_info('peername')[0]
+            port = parse227(await self._command('PASV'))[1]
+        reader, writer = await self._wait(asyncio.open_connection(host, port))
+        try:
+            if rest is not None:
+                await self._command('REST %s' % rest)
+            resp = await self._command(cmd)
+            if resp[0] == '2':
+                resp = await self._getresp()
+            if resp[0] != '1':
+                raise error_reply(resp)
+        except Exception:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def _command(self, cmd):
+        self._writer.write((cmd + '\r\n').encode(self.encoding))
+        await self._wait(self._writer.drain())
+        return await self._getresp()
+
+    async def _voidcmd(self, cmd):
+        resp = await self._command(cmd)
+        if resp[0] != '2':
+            raise error_reply(resp)
+        return resp
+
+    async def _voidresp(self):
+        resp = await self._getresp()
+        if resp[0] != '2':
+            raise error_reply(resp)
+        return resp
+
+    async def _getresp(self):
+        """ Read a (possibly multiline) reply, raising like ftplib on errors """
+        line = await self._getline()
+        if line[3:4] == '-':
+            code = line[:3]
+            lines = [line]
+            while True:
+                line = await self._getline()
+                lines.append(line)
+                if line[:3] == code and line[3:4] != '-':
+                    break
+            line = '\n'.join(lines)
+        c = line[:1]
+        if c in ('1', '2', '3'):
+            return line
+        if c == '4':
+            raise error_temp(line)
+        if c == '5':
+            raise error_perm(line)
+        raise error_proto(line)
+
+    async def _getline(self):
+        line = await self._wait(self._reader.readline())
+        if not line:
+            raise EOFError('Control connection closed')
+        return line.decode(self.encoding).rstrip('\r\n')
+
+    async def _wait(self, awaitable):
+        if self.timeout is None:
+            return await awaitable
+        return await asyncio.wait_for(awaitable, self.timeout)
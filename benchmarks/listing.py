@@ -0,0 +1,106 @@
+""" Benchmark directory listing parsing
+
+    python benchmarks/listing.py [lines]
+
+    Prints how many LIST lines per second split_file_info parses, next to
+    the parser it replaced (legacy_split_file_info below, kept for comparison).
+"""
+from __future__ import print_function
+import datetime
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from dateutil import parser
+from ftpretty import split_file_info
+
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _legacy_get_year(date):
+    from dateutil.relativedelta import relativedelta
+
+    current_date = datetime.datetime.now()
+    parsed_date = parser.parse("%s" % date)
+    if current_date > parsed_date:
+        current = current_date
+    else:
+        current = current_date - relativedelta(years=1)
+    return current.strftime('%Y')
+
+
+def legacy_split_file_info(fileinfo):
+    """ split_file_info as of 0.4.0, unix lines only """
+    files = []
+
+    unix_format = re.compile(
+        r'^([\-dbclps])' +
+        r'((?:[r-][w-][-xsStT]){3})\s+' +
+        r'(\d+)\s+' +
+        r'([a-zA-Z0-9_-]+)\s+' +
+        r'([a-zA-Z0-9_-]+)\s+' +
+        r'(\d+)\s+' +
+        r'(\w{3}\s+\d{1,2})\s+' +
+        r'(\d{1,2}:\d{1,2}|\d{4})\s+' +
+        r'(.+)$'
+    )
+
+    for line in fileinfo:
+        if unix_format.match(line):
+            parts = unix_format.split(line)
+
+            date = parts[7]
+            time_ = parts[8] if ':' in parts[8] else '00:00'
+            year = parts[8] if ':' not in parts[8] else _legacy_get_year(date)
+            dt_obj = parser.parse("%s %s %s" % (date, year, time_))
+
+            files.append({
+                'directory': parts[1],
+                'flags': parts[1],
+                'perms': parts[2],
+                'items': parts[3],
+                'owner': parts[4],
+                'group': parts[5],
+                'size': int(parts[6]),
+                'date': date,
+                'time': time_,
+                'year': year,
+                'name': parts[9],
+                'datetime': dt_obj
+            })
+    return files
+
+
+def make_listing(count):
+    lines = []
+    for i in range(count):
+        month = MONTHS[i % 12]
+        day = i % 28 + 1
+        if i % 3:
+            stamp = '%02d:%02d' % (i % 24, i % 60)
+        else:
+            stamp = '%d' % (2000 + i % 20)
+        lines.append('-rw-r--r-- 1 owner group %d %s %2d %5s file_%d.csv' % (
+            i * 7, month, day, stamp, i))
+    return lines
+
+
+def measure(name, parse, lines):
+    start = time.time()
+    parse(lines)
+    elapsed = time.time() - start
+    print('%-8s %d lines in %.2fs: %d lines/s' % (name, len(lines), elapsed, len(lines) / elapsed))
+
+
+def main(count=20000):
+    lines = make_listing(count)
+    measure('before', legacy_split_file_info, lines)
+    measure('after', split_file_info, lines)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
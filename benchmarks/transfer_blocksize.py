@@ -0,0 +1,67 @@
+""" Benchmark download throughput across block sizes
+
+    python benchmarks/transfer_blocksize.py [megabytes]
+
+    RETR data is served from a local socket pair by a sender thread, so the
+    numbers show the per block overhead of the receive loop rather than a
+    network. Prints MB/s for fixed block sizes and for blocksize='auto'.
+"""
+from __future__ import print_function
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ftpretty import ftpretty
+
+BLOCK_SIZES = [8192, 65536, 262144, 1 << 20, 'auto']
+
+
+class LoopbackFTP(object):
+    """ Just enough of ftplib.FTP to RETR size bytes over a socket pair """
+
+    def __init__(self, size):
+        self.size = size
+
+    def voidcmd(self, cmd):
+        return '200 OK'
+
+    def transfercmd(self, cmd, rest=None):
+        receiver, sender = socket.socketpair()
+        thread = threading.Thread(target=self._send, args=(sender,))
+        thread.daemon = True
+        thread.start()
+        return receiver
+
+    def voidresp(self):
+        return '226 Transfer complete'
+
+    def _send(self, sock):
+        chunk = b'\0' * (1 << 20)
+        left = self.size
+        while left:
+            sent = sock.send(chunk[:left])
+            left -= sent
+        sock.close()
+
+
+def measure(pretty, size, blocksize):
+    with open(os.devnull, 'wb') as sink:
+        start = time.time()
+        pretty.get('data.bin', sink, blocksize=blocksize)
+        elapsed = time.time() - start
+    print('%-8s %8.1f MB/s' % (blocksize, size / elapsed / 1e6))
+
+
+def main(megabytes=512):
+    size = megabytes * 1000 * 1000
+    pretty = ftpretty(None, None, None, ftp_conn=LoopbackFTP(size))
+    for blocksize in BLOCK_SIZES:
+        measure(pretty, size, blocksize)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -4,6 +4,7 @@ if sys.version_info[0] < 3:
     PY2 = True
     PY3 = False
     from cStringIO import StringIO
+    from Queue import Queue
     buffer_type = StringIO
     file_type = file
     stringtype = unicode
@@ -11,6 +12,7 @@ else:
     PY2 = False
     PY3 = True
     from io import IOBase, BytesIO
+    from queue import Queue
     file_type = IOBase
     buffer_type = BytesIO
     stringtype = str
\ No newline at end of file
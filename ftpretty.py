@@ -12,14 +12,35 @@
     f.rename(remote_from, remote_to)
     f.close()
 
+    pool = FtprettyPool(host, user, pass, size=4)
+    with pool.connection() as f:
+        f.get(remote, local)
+    pool.close()
+
 """
 from __future__ import print_function
+import calendar
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
 import datetime
-from ftplib import FTP, error_perm
+import fnmatch
+from ftplib import FTP, error_perm, error_proto, error_reply, error_temp
+import hashlib
+import heapq
+import mmap
 import os
+import posixpath
 import re
+import shutil
+import socket
+import sqlite3
+import stat
+import threading
+import time
+import zlib
 from dateutil import parser
-from compat import buffer_type, file_type
+from dateutil.tz import tzutc
+from compat import PY2, Queue, buffer_type, file_type, stringtype
 
 try:
     from ftplib import FTP_TLS
@@ -27,37 +48,241 @@ except ImportError:
     FTP_TLS = None
 
 
+_STOP = object()
+
+# Accepted values of the verify argument of put() and upload_tree()
+_VERIFY_MODES = (None, 'size', 'hash')
+
+# FEAT HASH algorithm names to hashlib (or zlib) names, in order of preference
+_HASH_ALGORITHMS = [
+    ('SHA-512', 'sha512'),
+    ('SHA-256', 'sha256'),
+    ('SHA-1', 'sha1'),
+    ('MD5', 'md5'),
+    ('CRC32', 'crc32'),
+]
+
+# Non standard hash commands, in order of preference
+_HASH_COMMANDS = [
+    ('XSHA512', 'sha512'),
+    ('XSHA256', 'sha256'),
+    ('XSHA1', 'sha1'),
+    ('XMD5', 'md5'),
+    ('XCRC', 'crc32'),
+]
+
+
+_MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+# Errors after which a transfer is worth retrying on a new connection
+_TRANSIENT_ERRORS = (socket.error, EOFError, error_temp, error_proto)
+
+
+class VerificationError(Exception):
+    """ An upload didn't match what the server reports it received """
+
+
+# What sync_down() and sync_up() did, or would do with dry_run=True
+# plan: (action, remote, local) tuples, errors: (remote, local, error) tuples
+SyncResult = namedtuple('SyncResult', ['plan', 'errors'])
+
+# What rmtree() did: files and dirs removed, errors as (path, error) tuples
+RmtreeResult = namedtuple('RmtreeResult', ['files', 'dirs', 'errors'])
+
+# Bytes, files and directories below a remote directory
+Totals = namedtuple('Totals', ['size', 'files', 'dirs'])
+
+# What tree_stats() found: totals for the tree, subtrees mapping directories
+# to their Totals, the largest files as (path, size) and errors as (path, error)
+TreeStats = namedtuple('TreeStats', ['size', 'files', 'dirs', 'subtrees', 'largest', 'errors'])
+
+
+class _RestRefused(error_perm):
+    """ The server doesn't support REST, raised by ranged downloads """
+
+
 class dotdict(dict):
     """dot.notation access to dictionary attributes"""
     __getattr__ = dict.get
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
 
+class FileEntry(object):
+    """ A directory listing entry
+
+        Fields can be read as attributes or keys, entry.name or entry['name'],
+        and unknown attributes are None as they were on the old dotdict. The
+        'items' field (the link count) is only available as entry['items'],
+        since entry.items() is the dict style list of (field, value) pairs.
+        datetime is only built the first time it is read.
+
+        An entry is not a dict subclass, use asdict() for json.dumps() and
+        other code that needs a real dict.
+    """
+    __slots__ = ('flags', 'perms', '_items', 'owner', 'group', 'size', 'date',
+                 'time', 'year', 'name', 'unique', '_datetime', '_stamp')
+    _fields = ('directory', 'flags', 'perms', 'items', 'owner', 'group', 'size',
+               'date', 'time', 'year', 'name', 'datetime', 'unique')
+
+    def __init__(self, flags=None, perms=None, items=None, owner=None, group=None,
+            size=None, date=None, time=None, year=None, name=None, datetime=None,
+            unique=None, stamp=None):
+        self.flags = flags
+        self.perms = perms
+        self._items = items
+        self.owner = owner
+        self.group = group
+        self.size = size
+        self.date = date
+        self.time = time
+        self.year = year
+        self.name = name
+        self.unique = unique
+        self._datetime = datetime
+        # datetime() arguments, used to build datetime on first access
+        self._stamp = stamp
+
+    def __getattr__(self, name):
+        # only called for names that aren't fields, private ones stay errors so
+        # copy and pickle protocols still work
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return None
+
+    @property
+    def directory(self):
+        """ Same as flags """
+        return self.flags
+
+    @directory.setter
+    def directory(self, value):
+        self.flags = value
+
+    @property
+    def datetime(self):
+        if self._datetime is None and self._stamp is not None:
+            self._datetime = datetime.datetime(*self._stamp)
+        return self._datetime
+
+    @datetime.setter
+    def datetime(self, value):
+        self._datetime = value
+        self._stamp = None
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return self._items if key == 'items' else getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, '_items' if key == 'items' else key, value)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def get(self, key, default=None):
+        return self[key] if key in self._fields else default
+
+    def keys(self):
+        return list(self._fields)
+
+    def values(self):
+        return [self[key] for key in self._fields]
+
+    def items(self):
+        return [(key, self[key]) for key in self._fields]
+
+    def asdict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, FileEntry):
+            other = other.asdict()
+        return self.asdict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'FileEntry(%s)' % ', '.join(
+            '%s=%r' % (key, self[key]) for key in self._fields[1:])
+
+
 class ftpretty(object):
     """ A wrapper for FTP connections """
     conn = None
     port = None
-    tmp_output = None
+    retry_delay = 1
+    min_segment_size = 1 << 20
+    # bytes per read, send or sendfile() call, 'auto' adapts it to throughput
+    blocksize = 65536
+    # send plain FTP uploads of files on disk with socket.sendfile
+    use_sendfile = True
+    # TransferManifest used to skip unchanged files, see put() and get()
+    manifest = None
+    # ListingCache for list() and stat() results
+    cache = None
+    # send batch() commands back to back, False once the server loses them
+    pipelining = True
+    # control commands on the wire at a time in a batch()
+    pipeline_window = 16
+    _features = None
     relative_paths = set(['.', '..'])
 
     def __init__(self, host, user, password,
             secure=False, passive=True, ftp_conn=None, **kwargs):
 
+        if ftp_conn is None:
+            self._connect_args = (host, user, password,
+                dict(kwargs, secure=secure, passive=passive))
+        else:
+            self._connect_args = None
+        self.known_dirs = set()
+
         if 'port' in kwargs:
             self.port = kwargs['port']
             del kwargs['port']
 
+        if 'blocksize' in kwargs:
+            self.blocksize = kwargs.pop('blocksize')
+            _BlockSize(self.blocksize)  # ValueError now rather than on the first transfer
+
+        if 'manifest' in kwargs:
+            manifest = kwargs.pop('manifest')
+            if isinstance(manifest, stringtype):
+                manifest = TransferManifest(manifest)
+                if self._connect_args is not None:
+                    # pooled and reconnected sessions share the one database
+                    self._connect_args[3]['manifest'] = manifest
+            self.manifest = manifest
+
+        if 'cache' in kwargs:
+            self.cache = kwargs.pop('cache')
+
         if ftp_conn:
             self.conn = ftp_conn
-        elif secure and FTP_TLS:
-            if self.port:
-                FTP_TLS.port = self.port
-            self.conn = FTP_TLS(host=host, user=user, passwd=password, **kwargs)
-            self.conn.prot_p()
         else:
-            if self.port:
-                FTP.port = self.port
-            self.conn = FTP(host=host, user=user, passwd=password, **kwargs)
+            # connect and login here rather than in the constructor so the port
+            # is passed per connection instead of set on the FTP class
+            self.conn = FTP_TLS(**kwargs) if secure and FTP_TLS else FTP(**kwargs)
+            if host:
+                self.conn.connect(host, self.port or 0)
+            if user:
+                self.conn.login(user, password, kwargs.get('acct', ''))
+            if secure and FTP_TLS:
+                self.conn.prot_p()
 
         if not passive:
             self.conn.set_pasv(False)
@@ -69,61 +294,332 @@ class ftpretty(object):
             return method(*args, **kwargs)
         return wrapper
 
-    def get(self, remote, local=None):
+    def get(self, remote, local=None, resume=False, retries=0, segments=1, pool=None,
+            mmap=False, blocksize=None, manifest=None):
         """ Gets the file from FTP server
 
             local can be:
                 a file: opened for writing, left open
                 a string: path to output file
+                a writable buffer (bytearray, memoryview, mmap): filled from
+                    the start, the number of bytes received is returned
                 None: contents are returned
+
+            mmap=True with a path sizes the local file from SIZE and receives
+            straight into a memory map of it, without intermediate copies.
+
+            blocksize overrides the session's blocksize for this call, an int
+            or 'auto' to keep doubling it while throughput improves.
+
+            resume=True continues a partial download, from the size of the
+            local file or the position of an open file.
+            retries is how many times a dropped transfer is continued, from
+            the last byte received, on a new connection.
+
+            segments=N splits a download to a path into N byte ranges fetched
+            on their own pooled connections and written in place. It falls back
+            to a single stream for small files, when REST is refused, or for
+            ftp_conn sessions that aren't given a pool.
+
+            manifest is a TransferManifest (the session's by default, False for
+            none). Downloads to a path are skipped when it holds a fresh listing
+            of the remote directory and the local file is unchanged since it was
+            last downloaded, the ones that happen are recorded.
         """
+        manifest = self.manifest if manifest is None else manifest
+        key = None
+        if manifest and not resume and isinstance(local, (bytes, stringtype)):
+            key = self.abspath(remote)
+            if manifest.fresh(posixpath.dirname(key)) and manifest.unchanged(key, local):
+                return None
+        if key is not None:
+            self.get(remote, local, retries=retries, segments=segments, pool=pool,
+                     mmap=mmap, blocksize=blocksize, manifest=False)
+            manifest.record(key, local)
+            return None
+
+        if mmap:
+            return self._get_mapped(remote, local, retries)
+        view = _writable_view(local) if local is not None else None
+        if view is not None:
+            return self._get_into(remote, view, retries)
+
+        if (segments > 1 and not resume and local is not None
+                and not isinstance(local, file_type)):
+            if self._segmented_get(remote, local, segments, pool):
+                return None
+
         if isinstance(local, file_type):  # open file, leave open
             local_file = local
+            offset = local.tell() if resume else 0
         elif local is None:  # return string
             local_file = buffer_type()
+            offset = 0
         else:  # path to file, open, write/close return None
-            local_file = open(local, 'wb')
+            offset = os.path.getsize(local) if resume and os.path.exists(local) else 0
+            local_file = open(local, 'ab' if offset else 'wb')
 
-        self.conn.retrbinary("RETR %s" % remote, local_file.write)
+        writer = _CountingWriter(local_file.write, offset)
+        blocks = self._block_size(blocksize)
 
-        if isinstance(local, file_type):
-            pass
-        elif local is None:
+        def attempt(retry):
+            self._retrieve(remote, writer, blocks)
+
+        try:
+            self._with_retries(retries, attempt)
+        finally:
+            if local is not None and not isinstance(local, file_type):
+                local_file.close()
+
+        if local is None:
             contents = local_file.getvalue()
             local_file.close()
             return contents
-        else:
-            local_file.close()
 
         return None
 
-    def put(self, local, remote, contents=None, quiet=False):
+    def _get_mapped(self, remote, local, retries):
+        """ Download to a path through a memory map sized from SIZE """
+        # servers may refuse SIZE, or count line endings, in ASCII mode
+        self.conn.voidcmd('TYPE I')
+        size = self.conn.size(remote)
+        with open(local, 'w+b') as local_file:
+            local_file.truncate(size)
+            if not size:
+                # empty files can't be mapped
+                return None
+            mapped = mmap.mmap(local_file.fileno(), size)
+            try:
+                view = memoryview(mapped)
+                self._get_into(remote, view, retries)
+                view.release()
+            finally:
+                mapped.close()
+        return None
+
+    def _get_into(self, remote, view, retries):
+        """ RETR straight into a writable byte view, returns the bytes received """
+        received = [0]
+
+        def attempt(retry):
+            self.conn.voidcmd('TYPE I')
+            sock = self.conn.transfercmd('RETR %s' % remote, received[0] or None)
+            overflow = False
+            try:
+                while received[0] < len(view):
+                    size = sock.recv_into(view[received[0]:])
+                    if not size:
+                        break
+                    received[0] += size
+                else:
+                    overflow = bool(sock.recv(1))
+                if not overflow and hasattr(sock, 'unwrap'):
+                    sock.unwrap()
+            finally:
+                sock.close()
+            if overflow:
+                self._abort_transfer()
+                raise ValueError('%s is larger than the %d byte buffer' % (remote, len(view)))
+            self.conn.voidresp()
+
+        self._with_retries(retries, attempt)
+        return received[0]
+
+    def _segmented_get(self, remote, local, segments, pool):
+        """ Download byte ranges in parallel, False if it isn't worth it or possible """
+        if pool is None and self._connect_args is None:
+            # ftp_conn sessions can't open the extra connections
+            return False
+        size = self._remote_size(remote)
+        segments = min(segments, size // self.min_segment_size)
+        if segments < 2:
+            return False
+
+        step = -(-size // segments)
+        ranges = [(start, min(start + step, size)) for start in range(0, size, step)]
+        remote = self.abspath(remote)
+
+        def handler(ftp, task):
+            ftp._get_range(remote, fd, task[0], task[1], size)
+
+        pool, owned = self._borrow_pool(len(ranges), pool)
+        try:
+            with open(local, 'wb') as local_file:
+                local_file.truncate(size)
+            fd = os.open(local, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+            try:
+                errors = _TaskPool(pool, len(ranges), handler, self).run(ranges)
+            finally:
+                os.close(fd)
+        finally:
+            if owned:
+                pool.close()
+        if any(isinstance(why, _RestRefused) for _, why in errors):
+            return False
+        if errors:
+            raise errors[0][1]
+        return True
+
+    def _get_range(self, remote, fd, start, end, size):
+        """ Write bytes start to end of remote at the same offsets of fd """
+        self.conn.voidcmd('TYPE I')
+        if start:
+            # sent here rather than by transfercmd to tell a refused REST
+            # apart from a failing RETR
+            try:
+                self.conn.sendcmd('REST %d' % start)
+            except (error_perm, error_reply) as why:
+                raise _RestRefused(why)
+        sock = self.conn.transfercmd('RETR %s' % remote)
+        pos = start
+        try:
+            while pos < end:
+                data = sock.recv(min(end - pos, 65536))
+                if not data:
+                    break
+                _pwrite(fd, data, pos)
+                pos += len(data)
+        finally:
+            sock.close()
+        if end < size:
+            self._abort_transfer()
+        else:
+            self.conn.voidresp()
+        if pos < end:
+            raise EOFError('Transfer of %s ended at %d, expected %d' % (remote, pos, end))
+
+    def _abort_transfer(self):
+        """ Stop a transfer early, leaving the control connection in sync
+
+            Depending on timing ABOR gets one or two replies, so a NOOP is
+            sent and everything up to its 200 is skipped.
+        """
+        try:
+            self.conn.abort()
+        except error_proto:
+            pass
+        self.conn.putcmd('NOOP')
+        while not self.conn.getmultiline().startswith('200'):
+            pass
+
+    def get_stream(self, remote, chunk_size=8192):
+        """ Open a remote file for streaming reads
+
+            Returns a file-like object with read()/readinto(), iterating over it
+            yields chunks of up to chunk_size bytes as they arrive. Close it (or
+            use it in a with block) before sending other commands.
+        """
+        self.conn.voidcmd('TYPE I')
+        sock = self.conn.transfercmd('RETR %s' % remote)
+        return _DownloadStream(self.conn, sock, chunk_size)
+
+    def put(self, local, remote, contents=None, quiet=False, direct=False,
+            verify='size', resume=False, retries=0, blocksize=None, manifest=None):
         """ Puts a local file (or contents) on to the FTP server
 
             local can be:
                 a string: path to inpit file
-                a file: opened for reading
+                a file (or anything with read()): opened for reading
+                an iterable of bytes chunks, e.g. a generator
                 None: contents are pushed
+
+            contents can be bytes, anything with read() or an iterable of
+            bytes chunks, streams are sent without being buffered in full
+
+            direct=True stores by path without changing the working directory,
+            missing directories are created with makedirs()
+
+            verify can be:
+                'size': the size reported by SIZE is returned
+                'hash': compare a digest taken while sending with the server's
+                    HASH/XSHA*/XMD5/XCRC, or SIZE when none is advertised
+                None: no check, the number of bytes sent is returned
+
+            VerificationError is raised when a check fails, ValueError for an
+            unknown verify mode
+
+            resume=True continues a partial upload from the size reported by
+            SIZE, using REST (or APPE when REST is refused).
+            retries is how many times a dropped upload is continued the same way
+            on a new connection, it needs a seekable source.
+
+            blocksize overrides the session's blocksize for this call, as in get()
+
+            manifest is a TransferManifest (the session's by default, False for
+            none). Uploads from a path are skipped, returning the recorded size,
+            when the file is unchanged since it was last uploaded to remote,
+            the ones that succeed are recorded.
         """
+        _check_verify(verify)
+        manifest = self.manifest if manifest is None else manifest
+        if (manifest and not contents and not resume
+                and isinstance(local, (bytes, stringtype))):
+            if remote.endswith('/'):
+                key = self.abspath(remote + os.path.basename(local))
+            else:
+                key = self.abspath(remote)
+            if manifest.unchanged(key, local):
+                return manifest.size(key)
+            try:
+                size = self.put(local, remote, direct=direct, verify=verify,
+                                retries=retries, blocksize=blocksize, manifest=False)
+            except:
+                if not quiet:
+                    raise
+                return 0
+            manifest.record(key, local, size)
+            return size
+        blocks = self._block_size(blocksize)
         remote_dir = os.path.dirname(remote)
         remote_file = os.path.basename(local)\
             if remote.endswith('/') else os.path.basename(remote)
 
         if contents:
             # local is ignored if contents is set
-            local_file = buffer_type(contents)
-        elif isinstance(local, file_type):
+            if hasattr(contents, 'read'):
+                local_file = contents
+            elif isinstance(contents, (bytes, bytearray, stringtype)):
+                local_file = buffer_type(contents)
+            else:
+                local_file = _ChunkReader(contents)
+        elif isinstance(local, file_type) or hasattr(local, 'read'):
             local_file = local
-        else:
+        elif isinstance(local, (bytes, stringtype)):
             local_file = open(local, 'rb')
+        else:
+            local_file = _ChunkReader(local)
+
+        if self.cache is not None:
+            self.cache.invalidate(self.abspath(posixpath.join(remote_dir, remote_file)))
 
-        if remote_dir:
-            self.descend(remote_dir, force=True)
+        if direct:
+            if remote_dir:
+                self.makedirs(remote_dir)
+                remote_file = posixpath.join(remote_dir, remote_file)
+            remote_dir = ''
+        elif remote_dir:
+            self._descend(remote_dir, force=True)
 
         size = 0
         try:
-            self.conn.storbinary('STOR %s' % remote_file, local_file)
-            size = self.conn.size(remote_file)
+            hash_command = self._hash_command() if verify == 'hash' else None
+            reader = _TransferReader(local_file, hash_command and hash_command[1], blocks)
+
+            def attempt(retry):
+                offset = self._remote_size(remote_file) if resume or retry else 0
+                if offset or retry:
+                    reader.seek(offset)
+                self._store(remote_file, reader, offset)
+
+            self._with_retries(retries, attempt)
+            if verify == 'size':
+                size = self.conn.size(remote_file)
+            else:
+                size = reader.count
+            if hash_command:
+                self._verify_hash(remote_file, hash_command[0], reader)
+            elif verify == 'hash' and self.conn.size(remote_file) != size:
+                raise VerificationError('Size mismatch for %s' % remote_file)
         except:
             if not quiet:
                 raise
@@ -135,11 +631,137 @@ class ftpretty(object):
                 self.conn.cwd(back)
         return size
 
-    def upload_tree(self, src, dst, ignore=None):
+    def _block_size(self, blocksize):
+        """ A _BlockSize for a call, the session's blocksize if None """
+        return _BlockSize(self.blocksize if blocksize is None else blocksize)
+
+    def _retrieve(self, remote, writer, blocks):
+        """ RETR from writer.count, receiving into one reused buffer """
+        rest = writer.count or None
+        if PY2:
+            self.conn.retrbinary('RETR %s' % remote, writer, blocks.size, rest=rest)
+            return
+        self.conn.voidcmd('TYPE I')
+        sock = self.conn.transfercmd('RETR %s' % remote, rest)
+        buf = memoryview(bytearray(blocks.capacity))
+        try:
+            while True:
+                size = sock.recv_into(buf[:blocks.size])
+                if not size:
+                    break
+                writer(buf[:size])
+                blocks.update(size)
+            if hasattr(sock, 'unwrap'):
+                sock.unwrap()
+        finally:
+            sock.close()
+        self.conn.voidresp()
+
+    def _store(self, remote, reader, offset):
+        """ STOR from offset, appending instead when REST is refused """
+        if self._can_sendfile(reader):
+            store = self._sendfile_store
+        else:
+            def store(cmd, reader, rest=None):
+                return self.conn.storbinary(cmd, reader, reader.blocks.size, rest=rest)
+        if not offset:
+            store('STOR %s' % remote, reader)
+            return
+        try:
+            store('STOR %s' % remote, reader, rest=offset)
+        except error_perm:
+            store('APPE %s' % remote, reader)
+
+    def _can_sendfile(self, reader):
+        """ sendfile needs a plain data connection, a file on disk and no hashing """
+        if PY2 or not self.use_sendfile or reader.algorithm:
+            return False
+        if FTP_TLS is not None and isinstance(self.conn, FTP_TLS):
+            return False
+        try:
+            return stat.S_ISREG(os.fstat(reader.fp.fileno()).st_mode)
+        except (AttributeError, OSError, ValueError):
+            return False
+
+    def _sendfile_store(self, cmd, reader, rest=None):
+        """ Like storbinary, with the kernel copying the file to the socket """
+        self.conn.voidcmd('TYPE I')
+        sock = self.conn.transfercmd(cmd, rest)
+        try:
+            reader.sendfile(sock)
+        finally:
+            sock.close()
+        return self.conn.voidresp()
+
+    def _remote_size(self, remote):
+        """ Size of a remote file, 0 if it doesn't exist """
+        # servers may refuse SIZE, or count line endings, in ASCII mode
+        self.conn.voidcmd('TYPE I')
+        try:
+            return self.conn.size(remote) or 0
+        except error_perm:
+            return 0
+
+    def _with_retries(self, retries, attempt):
+        """ Call attempt(retry) until it succeeds or retries run out
+
+            After a dropped connection the session is reconnected and returned
+            to the same working directory before attempt(True) is called.
+        """
+        cwd = self.conn.pwd() if retries else None
+        retry = False
+        while True:
+            try:
+                if retry and self.reconnect():
+                    self.conn.cwd(cwd)
+                return attempt(retry)
+            except _TRANSIENT_ERRORS:
+                if not retries:
+                    raise
+                retries -= 1
+                retry = True
+                time.sleep(self.retry_delay)
+
+    def reconnect(self):
+        """ Replace the control connection with a new logged in one
+
+            Returns False, leaving the connection alone, for sessions created
+            with ftp_conn as those can't be reopened.
+        """
+        if self._connect_args is None:
+            return False
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        host, user, password, connect_kwargs = self._connect_args
+        self.conn = ftpretty(host, user, password, **connect_kwargs).conn
+        self._features = None
+        self.known_dirs = set()
+        return True
+
+    def upload_tree(self, src, dst, ignore=None, workers=1, pool=None,
+            verify='size'):
         """ Recursively upload a directory tree.
 
         Although similar to shutil.copytree we don't follow symlinks.
+        verify is passed on to put().
+
+        With workers > 1 (or a pool) the remote directories are created
+        up front and the files are stored by absolute path on that many pooled
+        connections.
+
+        The return value depends on the mode. Serially dst is returned and
+        files that fail are skipped, as in 0.4. In parallel a list of
+        (src, dst, error) tuples is returned, empty when every file made it.
         """
+        _check_verify(verify)
+        if workers > 1 or pool is not None:
+            errors = self._parallel_upload_tree(src, dst, ignore, workers, pool, verify)
+            # the pooled connections may not share this session's cache
+            self._invalidate(dst.replace('\\', '/'))
+            return errors
+
         names = os.listdir(src)
         if ignore is not None:
             ignored_names = ignore(src, names)
@@ -151,6 +773,8 @@ class ftpretty(object):
             self.conn.mkd(dst)
         except error_perm:
             pass
+        else:
+            self._invalidate(dst)
 
         errors = []
         for name in names:
@@ -162,24 +786,74 @@ class ftpretty(object):
                 if os.path.islink(src_name):
                     pass
                 elif os.path.isdir(src_name):
-                    self.upload_tree(src_name, dst_name, ignore)
+                    self.upload_tree(src_name, dst_name, ignore, verify=verify)
                 else:
                     # Will raise a SpecialFileError for unsupported file types
-                    self.put(src_name, dst_name)
+                    self.put(src_name, dst_name, verify=verify)
             except Exception as why:
                 errors.append((src_name, dst_name, str(why)))
 
         return dst
 
+    def _parallel_upload_tree(self, src, dst, ignore, workers, pool, verify):
+        dst = self.abspath(dst.replace('\\', '/'))
+        dirs, files = [dst], []
+        pending = [(src, dst)]
+        while pending:
+            src_dir, dst_dir = pending.pop()
+            names = os.listdir(src_dir)
+            ignored_names = ignore(src_dir, names) if ignore is not None else set()
+            for name in names:
+                if name in ignored_names:
+                    continue
+                src_name = os.path.join(src_dir, name)
+                dst_name = posixpath.join(dst_dir, name)
+                if os.path.islink(src_name):
+                    continue
+                elif os.path.isdir(src_name):
+                    dirs.append(dst_name)
+                    pending.append((src_name, dst_name))
+                else:
+                    files.append((src_name, dst_name))
+
+        for remote_dir in dirs:
+            self.makedirs(remote_dir)
+
+        def handler(ftp, task):
+            src_name, dst_name = task
+            if posixpath.dirname(dst_name) not in ftp.known_dirs:
+                ftp.known_dirs.update(dirs)
+            ftp.put(src_name, dst_name, direct=True, verify=verify, manifest=self.manifest)
+
+        pool, owned = self._borrow_pool(workers, pool)
+        try:
+            errors = _TaskPool(pool, workers, handler, self).run(files)
+        finally:
+            if owned:
+                pool.close()
+        return [(task[0], task[1], str(why)) for task, why in errors]
+
     def put_tree(self, *args, **kwargs):
         """ Alias for upload_tree """
         return self.upload_tree(*args, **kwargs)        
 
-    def get_tree(self, remote, local):
+    def get_tree(self, remote, local, workers=1, pool=None):
         """ Recursively download a directory tree.
+
+        With workers > 1 (or a pool) directories are listed and files are
+        downloaded in parallel on that many pooled connections, which also caps
+        the number of simultaneous data connections.
+
+        The return value depends on the mode. Serially None is returned and the
+        first failure is raised, as in 0.4. In parallel a failure doesn't stop
+        the tree, a list of (remote, local, error) tuples is returned instead,
+        empty when every file made it.
         """
         remote = remote.replace('\\', '/')
-        for entry in self.list(remote, extra=True):
+        if workers > 1 or pool is not None:
+            return self._parallel_get_tree(remote, local, workers, pool)
+
+        for entry in self._tree_listing(self, remote):
             name = entry['name']
             remote_path = os.path.join(remote, name)
             local_path = os.path.join(local, name)
@@ -192,169 +866,1979 @@ class ftpretty(object):
             else:
                 pass
 
-    def list(self, remote='.', extra=False, remove_relative_paths=False):
-        """ Return directory list """
-        if extra:
-            self.tmp_output = []
-            self.conn.dir(remote, self._collector)
-            directory_list = split_file_info(self.tmp_output)
-        else:
-            directory_list = self.conn.nlst(remote)
+    def _parallel_get_tree(self, remote, local, workers, pool):
+        def handler(ftp, task):
+            kind, remote_path, local_path = task
+            if kind == 'get':
+                ftp.get(remote_path, local_path, manifest=self.manifest)
+                return
+            for entry in self._tree_listing(ftp, remote_path):
+                name = entry['name']
+                if name in self.relative_paths:
+                    continue
+                remote_child = posixpath.join(remote_path, name)
+                local_child = os.path.join(local_path, name)
+                if entry.flags == 'd':
+                    if not os.path.exists(local_child):
+                        os.mkdir(local_child)
+                    tasks.submit(('list', remote_child, local_child))
+                elif entry.flags == '-':
+                    tasks.submit(('get', remote_child, local_child))
 
-        if remove_relative_paths:
-            return list(filter(self.is_not_relative_path, directory_list))
+        pool, owned = self._borrow_pool(workers, pool)
+        try:
+            tasks = _TaskPool(pool, workers, handler, self)
+            errors = tasks.run([('list', self.abspath(remote), local)])
+        finally:
+            if owned:
+                pool.close()
+        return [(task[1], task[2], str(why)) for task, why in errors]
 
-        return directory_list
+    def walk(self, remote='.', workers=1, pool=None, extra=False, onerror=None):
+        """ Walk a remote tree like os.walk, yielding (dirpath, dirs, files)
 
-    def is_not_relative_path(self, path):
-        if isinstance(path, dict):
-            return path.get('name') not in self.relative_paths
-        else:
-            return path not in self.relative_paths
+            Directories are listed breadth first. dirs and files hold names or,
+            with extra=True, the FileEntry records. As with os.walk, removing
+            items from dirs keeps the walk out of those directories. A listing
+            the server refuses is passed to onerror(exception) when given, with
+            the directory in its filename attribute, and skipped either way.
 
-    def descend(self, remote, force=False):
-        """ Descend, possibly creating directories as needed """
-        remote_dirs = remote.split('/')
-        for directory in remote_dirs:
+            With workers > 1 (or a pool) the listings run on that many pooled
+            connections, with at most two directories per worker in flight so
+            memory stays bounded however fast the server answers. This session
+            is free for other commands while iterating, unless the pool has no
+            free connection: then the walk runs serially on this session.
+        """
+        remote = remote.replace('\\', '/')
+        if workers > 1 or pool is not None:
+            return self._parallel_walk(remote, workers, pool, extra, onerror)
+        return self._walk(remote, extra, onerror)
+
+    def _walk(self, remote, extra, onerror):
+        pending = deque([remote])
+        while pending:
+            path = pending.popleft()
             try:
-                self.conn.cwd(directory)
-            except Exception:
-                if force:
-                    self.conn.mkd(directory)
-                    self.conn.cwd(directory)
-        return self.conn.pwd()
+                entries = self.list(path, extra=True)
+            except (error_perm, error_temp) as why:
+                if onerror is not None:
+                    why.filename = path
+                    onerror(why)
+                continue
+            dirs, files = self._walk_split(entries, extra)
+            yield path, dirs, files
+            for item in dirs:
+                pending.append(posixpath.join(path, item.name if extra else item))
 
-    def delete(self, remote):
-        """ Delete a file from server """
-        try:
-            self.conn.delete(remote)
-        except Exception as exc:
+    def _parallel_walk(self, remote, workers, pool, extra, onerror):
+        results = Queue()
+
+        def handler(ftp, task):
             try:
-                self.conn.rmd(remote)
-            except:
+                results.put((task, ftp.list(task[1], extra=True), None))
+            except Exception as why:
+                results.put((task, None, why))
+
+        pending = deque([(remote, self.abspath(remote))])
+        in_flight = 0
+        pool, owned = self._borrow_pool(workers, pool)
+        # no fallback, the session stays free for the caller while iterating
+        tasks = _TaskPool(pool, workers, handler)
+        try:
+            if not tasks.start():
+                # every pooled connection is taken, waiting could deadlock
+                for item in self._walk(remote, extra, onerror):
+                    yield item
+                return
+            while pending or in_flight:
+                while pending and in_flight < 2 * tasks.workers:
+                    tasks.submit(pending.popleft())
+                    in_flight += 1
+                (path, abs_path), entries, why = results.get()
+                in_flight -= 1
+                if why is not None:
+                    if not isinstance(why, (error_perm, error_temp)):
+                        raise why
+                    if onerror is not None:
+                        why.filename = path
+                        onerror(why)
+                    continue
+                dirs, files = self._walk_split(entries, extra)
+                yield path, dirs, files
+                for item in dirs:
+                    name = item.name if extra else item
+                    pending.append((posixpath.join(path, name), posixpath.join(abs_path, name)))
+        finally:
+            tasks.stop()
+            if owned:
+                pool.close()
+
+    def find(self, remote='.', name_glob=None, min_size=None, newer_than=None, type=None,
+            maxdepth=None, prune=None, workers=1, pool=None, nlst=False):
+        """ Yield (path, entry) for everything below remote passing every test
+
+            name_glob: shell pattern the name must match, case sensitive
+            min_size: smallest size in bytes
+            newer_than: a datetime or seconds since the epoch, the entry's
+                modification time must be later
+            type: 'f' for files, 'd' for directories, 'l' for links
+            maxdepth: how many levels below remote to look, 1 for remote only
+            prune: prune(path, entry) returns True for directories not to
+                descend into, they are still yielded if they match
+
+            Matches are yielded as each directory listing is parsed, so
+            stopping early skips the rest of the tree. The walk itself is
+            walk(), workers and pool are passed on to it.
+
+            With nlst=True, maxdepth=1 and only name_glob, the pattern is sent
+            to the server with NLST instead of listing the directory, which
+            servers that glob answer with just the matching names; those
+            entries only carry the name.
+        """
+        if type not in (None, 'f', 'd', 'l'):
+            raise ValueError('Unknown type %r, expected f, d or l' % (type,))
+        remote = remote.replace('\\', '/')
+        if isinstance(newer_than, datetime.datetime):
+            newer_than = _timestamp(newer_than)
+        if nlst:
+            if (maxdepth != 1 or not name_glob or '/' in name_glob or min_size is not None
+                    or newer_than is not None or type is not None or prune is not None):
+                raise ValueError('nlst=True takes only name_glob, with maxdepth=1')
+            return self._find_nlst(remote, name_glob)
+        return self._find(remote, name_glob, min_size, newer_than,
+                          {'f': '-', 'd': 'd', 'l': 'l'}.get(type), maxdepth, prune,
+                          workers, pool)
+
+    def _find(self, remote, name_glob, min_size, newer_than, flags, maxdepth, prune,
+              workers, pool):
+        if maxdepth is not None and maxdepth < 1:
+            return
+
+        def matches(entry):
+            if flags is not None and entry.flags != flags:
                 return False
-        else:
+            if name_glob is not None and not fnmatch.fnmatchcase(entry.name, name_glob):
+                return False
+            if min_size is not None and (entry.size is None or entry.size < min_size):
+                return False
+            if newer_than is not None:
+                stamp = _timestamp(entry.datetime)
+                if stamp is None or stamp <= newer_than:
+                    return False
             return True
 
-    def cd(self, remote):
-        """ Change working directory on server """
+        depths = {remote: 1}
+        for dirpath, dirs, files in self.walk(remote, workers, pool, extra=True):
+            depth = depths.pop(dirpath)
+            for entry in dirs + files:
+                if matches(entry):
+                    yield posixpath.join(dirpath, entry.name), entry
+            if maxdepth is not None and depth >= maxdepth:
+                dirs[:] = []
+            elif prune is not None:
+                dirs[:] = [entry for entry in dirs
+                           if not prune(posixpath.join(dirpath, entry.name), entry)]
+            for entry in dirs:
+                depths[posixpath.join(dirpath, entry.name)] = depth + 1
+
+    def _find_nlst(self, remote, name_glob):
         try:
-            self.conn.cwd(remote)
-        except Exception:
-            return False
-        else:
-            return self.pwd()
+            names = self.conn.nlst(posixpath.join(remote, name_glob))
+        except (error_perm, error_temp):
+            # some servers refuse a pattern without matches (450 or 550), or any pattern
+            try:
+                names = self.conn.nlst(remote)
+            except (error_perm, error_temp):
+                return
+        for name in names:
+            # the server may answer with paths, or ignore the pattern
+            name = posixpath.basename(name.rstrip('/'))
+            if name not in self.relative_paths and fnmatch.fnmatchcase(name, name_glob):
+                yield posixpath.join(remote, name), FileEntry(name=name)
 
-    def pwd(self):
-        """ Return the current working directory """
-        return self.conn.pwd()
+    def rmtree(self, remote, workers=1, pool=None):
+        """ Delete a remote directory and everything below it
 
-    def rename(self, remote_from, remote_to):
-        """ Rename a file on the server """
-        return self.conn.rename(remote_from, remote_to)
+            The tree is walked first, then every file is deleted, then the
+            directories are removed deepest first. With workers > 1 (or a pool)
+            the listings, the deletes and the removals of directories at the
+            same depth run on that many pooled connections. Directories still
+            holding something that failed are left in place.
 
-    def mkdir(self, new_dir):
-        """ Create directory on the server """
-        return self.conn.mkd(new_dir)
+            Returns an RmtreeResult of the number of files and directories
+            removed and the (path, error) tuples of what failed.
+        """
+        remote = self.abspath(remote.replace('\\', '/'))
+        errors = []
+        blocked = set()
 
-    def close(self):
-        """ End the session """
+        def failed(path, why):
+            errors.append((path, str(why)))
+            path = posixpath.dirname(path)
+            while path.startswith(remote) and path not in blocked:
+                blocked.add(path)
+                path = posixpath.dirname(path)
+
+        def unlisted(why):
+            blocked.add(why.filename)
+            failed(why.filename, why)
+
+        parallel = workers > 1 or pool is not None
+        if parallel:
+            pool, owned = self._borrow_pool(workers, pool)
         try:
-            self.conn.quit()
-        except Exception:
-            self.conn.close()
+            files, levels = [], {}
+            for dirpath, dirs, names in self.walk(remote, workers, pool, onerror=unlisted):
+                levels.setdefault(dirpath.count('/'), []).append(dirpath)
+                files.extend(posixpath.join(dirpath, name) for name in names)
 
-    def _collector(self, line):
-        """ Helper for collecting output from dir() """
-        self.tmp_output.append(line)
+            failures = self._run_tasks(files, workers, pool, lambda ftp, path: ftp.conn.delete(path))
+            for path, why in failures:
+                failed(path, why)
+            removed_files = len(files) - len(failures)
 
+            removed_dirs = 0
+            for depth in sorted(levels, reverse=True):
+                dirs = [path for path in levels[depth] if path not in blocked]
+                failures = self._run_tasks(dirs, workers, pool, lambda ftp, path: ftp.conn.rmd(path))
+                for path, why in failures:
+                    failed(path, why)
+                removed_dirs += len(dirs) - len(failures)
+        finally:
+            if parallel and owned:
+                pool.close()
+            self._invalidate(remote)
+            if self.manifest:
+                self.manifest.forget(remote)
+            self.known_dirs.clear()
+        return RmtreeResult(removed_files, removed_dirs, errors)
 
-def _get_year(date):
-    from dateutil.relativedelta import relativedelta
+    def tree_stats(self, remote='.', workers=1, pool=None, top=10, depth=1):
+        """ Sizes and counts for a remote tree, from a single walk()
 
-    current_date = datetime.datetime.now()
-    parsed_date = parser.parse("%s" % date)
-    if current_date > parsed_date:
-        current = current_date
-    else:
-        current = current_date - relativedelta(years=1)
-    return current.strftime('%Y')
+            Returns a TreeStats of the total bytes, files and directories, the
+            Totals of every directory up to depth levels below remote, the top
+            largest files as (path, size) tuples, largest first, and the
+            (path, error) tuples of listings that failed. Memory depends on top
+            and the number of directories within depth, not on the number of
+            files. workers and pool are passed on to walk().
+        """
+        remote = remote.replace('\\', '/')
+        totals = [0, 0, 0]
+        subtrees = {}
+        largest = []
+        errors = []
 
-   
-def split_file_info(fileinfo):
-    """ Parse sane directory output usually ls -l
-        Adapted from https://gist.github.com/tobiasoberrauch/2942716
-    """
-    files = []
+        def unlisted(why):
+            errors.append((why.filename, str(why)))
 
-    unix_format = re.compile(
-        r'^([\-dbclps])' +                  # Directory flag [1]
-        r'((?:[r-][w-][-xsStT]){3})\s+' +   # Permissions [2]
-        r'(\d+)\s+' +                       # Number of items [3]
-        r'([a-zA-Z0-9_-]+)\s+' +            # File owner [4]
-        r'([a-zA-Z0-9_-]+)\s+' +            # File group [5]
-        r'(\d+)\s+' +                       # File size in bytes [6]
-        r'(\w{3}\s+\d{1,2})\s+' +           # 3-char month and 1/2-char day of the month [7]
-        r'(\d{1,2}:\d{1,2}|\d{4})\s+' +     # Time or year (need to check conditions) [+= 7]
-        r'(.+)$'                            # File/directory name [8]
-    )
-
-    # not exactly sure what format this, but seems windows-esque
-    # attempting to address issue: https://github.com/codebynumbers/ftpretty/issues/34
-    # can get better results with more data.
-    windows_format = re.compile(
-        r'(\d{2})-(\d{2})-(\d{2})\s+' +     # month/day/2-digit year (assuming after 2000)
-        r'(\d{2}):(\d{2})([AP])M\s+' +      # time
-        r'(\d+)\s+' +                       # file size
-        r'(.+)$'                            # filename
-    )
+        for dirpath, dirs, files in self.walk(remote, workers, pool, extra=True,
+                                              onerror=unlisted):
+            parts = dirpath[len(remote):].lstrip('/').split('/') if dirpath != remote else []
+            counted = [totals] + [subtrees[posixpath.join(remote, *parts[:level])]
+                                  for level in range(1, min(len(parts), depth) + 1)]
+            size = 0
+            for entry in files:
+                size += entry.size or 0
+                if top:
+                    item = (entry.size or 0, posixpath.join(dirpath, entry.name))
+                    if len(largest) < top:
+                        heapq.heappush(largest, item)
+                    elif item > largest[0]:
+                        heapq.heapreplace(largest, item)
+            for record in counted:
+                record[0] += size
+                record[1] += len(files)
+                record[2] += len(dirs)
+            if len(parts) < depth:
+                for entry in dirs:
+                    subtrees[posixpath.join(dirpath, entry.name)] = [0, 0, 0]
 
-    for line in fileinfo:
-        if unix_format.match(line):
-            parts = unix_format.split(line)
-
-            date = parts[7]
-            time = parts[8] if ':' in parts[8] else '00:00'
-            year = parts[8] if ':' not in parts[8] else _get_year(date)
-            dt_obj = parser.parse("%s %s %s" % (date, year, time))
-
-            files.append(dotdict({
-                'directory': parts[1],
-                'flags': parts[1],
-                'perms': parts[2],
-                'items': parts[3],
-                'owner': parts[4],
-                'group': parts[5],
-                'size': int(parts[6]),
-                'date': date,
-                'time': time,
-                'year': year,
-                'name': parts[9],
-                'datetime': dt_obj
-            }))
-
-        elif windows_format.match(line):
-            parts = windows_format.split(line)
+        return TreeStats(
+            totals[0], totals[1], totals[2],
+            dict((path, Totals(*record)) for path, record in subtrees.items()),
+            [(path, size) for size, path in sorted(largest, reverse=True)],
+            errors)
 
-            hour = int(parts[4])
-            hour += 12 if parts[6] == 'P' else 0
-            hour = 0 if hour == 24 else hour
-            year = int(parts[3]) + 2000
-            dt_obj = datetime.datetime(year, int(parts[1]), int(parts[2]), hour, int(parts[5]), 0)
-
-            files.append(dotdict({
-                'directory': None,
-                'flags': None,
-                'perms': None,
-                'items': None,
-                'owner': None,
-                'group': None,
-                'size': int(parts[7]),
-                'date': "{}-{}-{}".format(*parts[1:4]),
-                'time': "{}:{}{}".format(*parts[4:7]),
-                'year': year,
-                'name': parts[8],
-                'datetime': dt_obj
-            }))
+    def du(self, remote='.', workers=1, pool=None):
+        """ Total bytes of the files below remote, see tree_stats() """
+        return self.tree_stats(remote, workers, pool, top=0, depth=0).size
+
+    def _walk_split(self, entries, extra):
+        """ Split a listing into (dirs, files), as names or entries """
+        dirs, files = [], []
+        for entry in entries:
+            if entry.name in self.relative_paths:
+                continue
+            (dirs if entry.flags == 'd' else files).append(entry if extra else entry.name)
+        return dirs, files
+
+    def _tree_listing(self, ftp, remote):
+        """ list(extra=True) on ftp, from the manifest while it has a fresh listing """
+        if not self.manifest:
+            return ftp.list(remote, extra=True)
+        path = ftp.abspath(remote)
+        entries = self.manifest.listing(path)
+        if entries is None:
+            entries = ftp.list(remote, extra=True)
+            self.manifest.store_listing(path, entries)
+        return entries
+
+    def sync_down(self, remote, local, delete=False, dry_run=False, workers=1, pool=None):
+        """ Mirror a remote tree into a local directory
 
+            Only files that are missing locally, differ in size or have a
+            different modification time are downloaded, and their local mtime
+            is set to the remote one so unchanged files match next time.
+            delete=True also removes local files and directories that are
+            not on the server. Downloads run on workers pooled connections.
+
+            Returns a SyncResult of the plan, a list of (action, remote,
+            local) with the actions 'mkdir', 'get', 'delete' and 'rmdir', and
+            the (remote, local, error) tuples of the steps that failed.
+            dry_run=True only makes the plan.
+        """
+        remote = self.abspath(remote.replace('\\', '/'))
+        remote_dirs, remote_files = self._scan_remote(remote)
+        local_dirs, local_files = _scan_local(local)
+
+        plan = []
+        if not os.path.isdir(local):
+            plan.append(('mkdir', remote, local))
+        for path in sorted(remote_dirs - local_dirs):
+            plan.append(('mkdir', posixpath.join(remote, path), _local_join(local, path)))
+        for path, entry in sorted(remote_files.items()):
+            info = local_files.get(path)
+            stamp = _timestamp(entry.datetime)
+            if (info is None or info.st_size != entry.size
+                    or (stamp is not None and abs(info.st_mtime - stamp) >= 1)):
+                plan.append(('get', posixpath.join(remote, path), _local_join(local, path)))
+        if delete:
+            plan.extend(_deletions(remote, local, local_files, remote_files, local_dirs, remote_dirs))
+        if dry_run:
+            return SyncResult(plan, [])
+
+        def handler(ftp, task):
+            remote_path, local_path = task
+            ftp.get(remote_path, local_path, manifest=False)
+            stamp = _timestamp(remote_files[posixpath.relpath(remote_path, remote)].datetime)
+            if stamp is not None:
+                os.utime(local_path, (stamp, stamp))
+
+        def remove(action, remote_path, local_path):
+            if action == 'delete':
+                os.remove(local_path)
+            else:
+                shutil.rmtree(local_path)
+
+        errors = self._apply_plan(plan, workers, pool, 'get', handler, remove,
+                                  lambda remote_path, local_path: os.makedirs(local_path))
+        return SyncResult(plan, errors)
+
+    def sync_up(self, local, remote, delete=False, dry_run=False, workers=1, pool=None):
+        """ Mirror a local directory onto the server
+
+            Only files that are missing remotely, differ in size or were
+            modified locally after the remote copy are uploaded. The remote
+            time is compared with the precision the listing gives: a second
+            for MLSD, a minute for LIST, a day for LIST entries showing a year.
+            delete=True also removes remote files and directories that are
+            not in the local tree. Uploads run on workers pooled connections.
+
+            Returns a SyncResult like sync_down(), with 'put' instead of 'get'.
+        """
+        remote = self.abspath(remote.replace('\\', '/'))
+        try:
+            remote_dirs, remote_files = self._scan_remote(remote)
+            remote_exists = True
+        except error_perm:
+            remote_dirs, remote_files, remote_exists = set(), {}, False
+        local_dirs, local_files = _scan_local(local)
+
+        plan = []
+        if not remote_exists:
+            plan.append(('mkdir', remote, local))
+        for path in sorted(local_dirs - remote_dirs):
+            plan.append(('mkdir', posixpath.join(remote, path), _local_join(local, path)))
+        for path, info in sorted(local_files.items()):
+            entry = remote_files.get(path)
+            if entry is not None:
+                stamp = _timestamp(entry.datetime)
+            if (entry is None or info.st_size != entry.size
+                    or (stamp is not None and info.st_mtime >= stamp + _precision(entry))):
+                plan.append(('put', posixpath.join(remote, path), _local_join(local, path)))
+        if delete:
+            plan.extend(_deletions(remote, local, remote_files, local_files, remote_dirs, local_dirs,
+                                   every_dir=True))
+        if dry_run:
+            return SyncResult(plan, [])
+
+        created = [remote_path for action, remote_path, _ in plan if action == 'mkdir']
+
+        def handler(ftp, task):
+            remote_path, local_path = task
+            ftp.known_dirs.update(created)
+            ftp.put(local_path, remote_path, direct=True, manifest=False)
+
+        def remove(action, remote_path, local_path):
+            self._invalidate(remote_path)
+            if action == 'delete':
+                self.conn.delete(remote_path)
+            else:
+                self.conn.rmd(remote_path)
+
+        errors = self._apply_plan(plan, workers, pool, 'put', handler, remove,
+                                  lambda remote_path, local_path: self.makedirs(remote_path))
+        # the pooled connections may not share this session's cache
+        self._invalidate(remote)
+        return SyncResult(plan, errors)
+
+    def _scan_remote(self, remote):
+        """ Return (dirs, files) below remote, relative paths with files mapped to entries """
+        dirs, files = set(), {}
+        pending = ['']
+        while pending:
+            rel = pending.pop()
+            for entry in self.iter_list(posixpath.join(remote, rel) if rel else remote):
+                if entry.name in self.relative_paths:
+                    continue
+                path = posixpath.join(rel, entry.name)
+                if entry.flags == 'd':
+                    dirs.add(path)
+                    pending.append(path)
+                elif entry.flags == '-':
+                    files[path] = entry
+        return dirs, files
+
+    def _apply_plan(self, plan, workers, pool, transfer, handler, remove, mkdir):
+        """ Carry out a sync plan: directories, transfers in parallel, then deletions """
+        errors = []
+        for action, remote_path, local_path in plan:
+            if action == 'mkdir':
+                try:
+                    mkdir(remote_path, local_path)
+                except Exception as why:
+                    errors.append((remote_path, local_path, str(why)))
+
+        tasks = [(r, l) for action, r, l in plan if action == transfer]
+        for task, why in self._run_tasks(tasks, workers, pool, handler):
+            errors.append((task[0], task[1], str(why)))
+
+        for action, remote_path, local_path in plan:
+            if action in ('delete', 'rmdir'):
+                try:
+                    remove(action, remote_path, local_path)
+                except Exception as why:
+                    errors.append((remote_path, local_path, str(why)))
+        return errors
+
+    def _run_tasks(self, tasks, workers, pool, handler):
+        """ Call handler(ftp, task) for each task, here or on pooled connections
+
+            Returns the (task, exception) pairs of the tasks that failed.
+        """
+        if workers <= 1 and pool is None:
+            errors = []
+            for task in tasks:
+                try:
+                    handler(self, task)
+                except Exception as why:
+                    errors.append((task, why))
+            return errors
+        pool, owned = self._borrow_pool(workers, pool)
+        try:
+            return _TaskPool(pool, workers, handler, self).run(tasks)
+        finally:
+            if owned:
+                pool.close()
+
+    def pool(self, size=4, **kwargs):
+        """ Create a FtprettyPool connecting the same way as this session """
+        if self._connect_args is None:
+            raise ValueError('Cannot open new connections for ftp_conn, pass a pool instead')
+        host, user, password, connect_kwargs = self._connect_args
+        connect_kwargs = dict(connect_kwargs, **kwargs)
+        return FtprettyPool(host, user, password, size=size, **connect_kwargs)
+
+    def _borrow_pool(self, workers, pool):
+        """ Return (pool, owned), creating a pool for this call if needed """
+        if pool is not None:
+            return pool, False
+        return self.pool(size=workers), True
+
+    def abspath(self, remote):
+        """ Resolve a remote path against the current working directory """
+        if remote.startswith('/'):
+            return posixpath.normpath(remote)
+        return posixpath.normpath(posixpath.join(self.pwd(), remote))
+
+    def list(self, remote='.', extra=False, remove_relative_paths=False, mlsd=None):
+        """ Return directory list
+
+            With extra=True MLSD is used when the server advertises MLST in FEAT,
+            mlsd=True/False forces it on or off.
+
+            With a cache the listing is looked up there first.
+        """
+        if self.cache is not None:
+            directory_list = list(self.cache.fetch(
+                ('list', self.abspath(remote), bool(extra), mlsd),
+                lambda: self._list(remote, extra, mlsd)))
+        else:
+            directory_list = self._list(remote, extra, mlsd)
+
+        if remove_relative_paths:
+            return list(filter(self.is_not_relative_path, directory_list))
+
+        return directory_list
+
+    def _list(self, remote, extra, mlsd):
+        if extra:
+            return list(self.iter_list(remote, mlsd))
+        return self.conn.nlst(remote)
+
+    def iter_list(self, remote='.', mlsd=None):
+        """ Yield directory entries as the listing arrives
+
+            Like list(extra=True), but each line is parsed as it is read so huge
+            directories can be processed in constant memory.
+        """
+        if mlsd is None:
+            mlsd = 'MLST' in self.features()
+        if mlsd:
+            for line in self._iter_lines('MLSD %s' % remote):
+                entry = _parse_mlsd_line(line)
+                if entry is not None:
+                    yield entry
+        else:
+            listing_parser = _ListingParser()
+            for line in self._iter_lines('LIST %s' % remote):
+                entry = listing_parser.parse(line)
+                if entry is not None:
+                    yield entry
+
+    def _iter_lines(self, cmd):
+        """ Yield the lines of a text transfer, like retrlines() without a callback """
+        self.conn.sendcmd('TYPE A')
+        sock = self.conn.transfercmd(cmd)
+        if PY2:
+            fp = sock.makefile('rb')
+        else:
+            fp = sock.makefile('r', encoding=self.conn.encoding)
+        complete = False
+        try:
+            for line in fp:
+                yield line.rstrip('\r\n')
+            if hasattr(sock, 'unwrap'):
+                sock.unwrap()
+            complete = True
+        finally:
+            fp.close()
+            sock.close()
+            if complete:
+                self.conn.voidresp()
+            else:
+                # abandoned early, the reply is a 226 or 426 we don't care about
+                try:
+                    self.conn.voidresp()
+                except Exception:
+                    pass
+
+    def stat(self, remote):
+        """ Return the entry for a single path, or None if it doesn't exist
+
+            Uses MLST when the server advertises it, otherwise lists the parent.
+            With a cache the entry is looked up there first.
+        """
+        if self.cache is not None:
+            return self.cache.fetch(('stat', self.abspath(remote)), lambda: self._stat(remote))
+        return self._stat(remote)
+
+    def _stat(self, remote):
+        if 'MLST' in self.features():
+            try:
+                resp = self.conn.sendcmd('MLST %s' % remote)
+            except error_perm:
+                return None
+            for line in resp.splitlines():
+                if line.startswith(' '):
+                    entry = _parse_mlsd_line(line[1:], keep_relative=True)
+                    entry['name'] = posixpath.basename(entry['name'].rstrip('/')) or entry['name']
+                    return entry
+            return None
+
+        parent, name = posixpath.split(remote.rstrip('/'))
+        for entry in self.list(parent or '.', extra=True):
+            if entry['name'] == name:
+                return entry
+        return None
+
+    def is_not_relative_path(self, path):
+        if isinstance(path, (dict, FileEntry)):
+            return path.get('name') not in self.relative_paths
+        else:
+            return path not in self.relative_paths
+
+    def descend(self, remote, force=False):
+        """ Descend, possibly creating directories as needed """
+        self._descend(remote, force)
+        self.forget_relative_dirs()
+        return self.conn.pwd()
+
+    def _descend(self, remote, force):
+        """ Descend without leaving the working directory known_dirs refer to
+
+            Paths in known_dirs are entered with a single CWD.
+        """
+        key = posixpath.normpath(remote)
+        if force and key in self.known_dirs:
+            try:
+                self.conn.cwd(remote)
+                return
+            except Exception:
+                self.known_dirs.clear()
+
+        remote_dirs = remote.split('/')
+        for directory in remote_dirs:
+            try:
+                self.conn.cwd(directory)
+            except Exception:
+                if force:
+                    self.conn.mkd(directory)
+                    self.conn.cwd(directory)
+        if force:
+            self.known_dirs.add(key)
+
+    def makedirs(self, remote):
+        """ Create a remote directory and any missing parents
+
+            Directories already created or confirmed on this connection are
+            remembered in known_dirs and skipped.
+        """
+        remote = posixpath.normpath(remote.replace('\\', '/'))
+        missing = []
+        path = remote
+        while path not in self.known_dirs and posixpath.basename(path) not in ('', '.', '..'):
+            missing.append(path)
+            path = posixpath.dirname(path)
+        for path in reversed(missing):
+            try:
+                self.conn.mkd(path)
+            except error_perm:
+                pass
+            else:
+                self._invalidate(path)
+            self.known_dirs.add(path)
+        return remote
+
+    def forget_relative_dirs(self):
+        """ Drop known_dirs entries relative to the old working directory """
+        self.known_dirs = set(d for d in self.known_dirs if d.startswith('/'))
+
+    def delete(self, remote):
+        """ Delete a file from server """
+        self._removed(remote)
+        try:
+            self.conn.delete(remote)
+        except Exception as exc:
+            try:
+                self.conn.rmd(remote)
+                self.known_dirs.clear()
+            except:
+                return False
+        else:
+            return True
+
+    def cd(self, remote):
+        """ Change working directory on server """
+        try:
+            self.conn.cwd(remote)
+        except Exception:
+            return False
+        else:
+            self.forget_relative_dirs()
+            return self.pwd()
+
+    def features(self):
+        """ Return the FEAT reply as a dict of feature name to its parameters """
+        if self._features is None:
+            try:
+                resp = self.conn.sendcmd('FEAT')
+            except error_perm:
+                resp = ''
+            features = {}
+            for line in resp.splitlines():
+                if line.startswith(' '):
+                    name, _, params = line.strip().partition(' ')
+                    features[name.upper()] = params
+            self._features = features
+        return self._features
+
+    def _hash_command(self):
+        """ Pick a hash command the server advertises, as (command, algorithm) """
+        features = self.features()
+        if 'HASH' in features:
+            names = [n.strip().upper() for n in features['HASH'].split(';')]
+            algorithms = dict(_HASH_ALGORITHMS)
+            for name in names:
+                if name.endswith('*') and name[:-1] in algorithms:
+                    return ('HASH', algorithms[name[:-1]])
+            for name, algorithm in _HASH_ALGORITHMS:
+                if name in names:
+                    try:
+                        self.conn.sendcmd('OPTS HASH %s' % name)
+                    except error_perm:
+                        continue
+                    return ('HASH', algorithm)
+        for command, algorithm in _HASH_COMMANDS:
+            if command in features:
+                return (command, algorithm)
+        return None
+
+    def _verify_hash(self, remote, command, reader):
+        """ Compare the server's digest of remote with the one taken locally """
+        resp = self.conn.sendcmd('%s %s' % (command, remote)).split()
+        # HASH replies "213 SHA-256 0-49 <digest> <path>", others "2xx <digest>"
+        digest = resp[3] if command == 'HASH' else resp[1]
+        if int(digest, 16) != int(reader.hexdigest(), 16):
+            raise VerificationError('%s mismatch for %s' % (command, remote))
+
+    def pwd(self):
+        """ Return the current working directory """
+        return self.conn.pwd()
+
+    def rename(self, remote_from, remote_to):
+        """ Rename a file on the server """
+        self._renamed(remote_from, remote_to)
+        return self.conn.rename(remote_from, remote_to)
+
+    def mkdir(self, new_dir):
+        """ Create directory on the server """
+        result = self.conn.mkd(new_dir)
+        self._created(new_dir)
+        return result
+
+    def batch(self, window=None):
+        """ Start a Batch of control commands to pipeline
+
+            window is how many commands are sent ahead of their replies,
+            pipeline_window by default.
+        """
+        return Batch(self, self.pipeline_window if window is None else window)
+
+    def _send_lines(self, lines):
+        """ Write control commands in one go, without waiting for replies """
+        data = ''.join(line + '\r\n' for line in lines)
+        if not isinstance(data, bytes):
+            data = data.encode(self.conn.encoding)
+        self.conn.sock.sendall(data)
+
+    def _created(self, remote):
+        self.known_dirs.add(posixpath.normpath(remote))
+        self._invalidate(remote)
+
+    def _removed(self, remote, directory=False):
+        if directory:
+            self.known_dirs.clear()
+        self._invalidate(remote)
+        if self.manifest:
+            self.manifest.forget(self.abspath(remote))
+
+    def _renamed(self, remote_from, remote_to):
+        self.known_dirs.clear()
+        self._invalidate(remote_from, remote_to)
+        if self.manifest:
+            self.manifest.forget(self.abspath(remote_from))
+            self.manifest.mark_stale(posixpath.dirname(self.abspath(remote_to)))
+
+    def _invalidate(self, *remotes):
+        """ Drop cached listings and entries of paths being changed """
+        if self.cache is not None:
+            for remote in remotes:
+                self.cache.invalidate(self.abspath(remote))
+
+    def close(self):
+        """ End the session """
+        try:
+            self.conn.quit()
+        except Exception:
+            self.conn.close()
+
+
+class _PooledConnection(object):
+    """ Bookkeeping for a connection owned by FtprettyPool """
+    __slots__ = ('ftp', 'home', 'created', 'last_used')
+
+    def __init__(self, ftp, home):
+        self.ftp = ftp
+        self.home = home
+        self.created = self.last_used = time.time()
+
+
+class FtprettyPool(object):
+    """ A bounded pool of logged in ftpretty connections
+
+        All connections in a pool log in to the same host, port and user.
+        Borrow one with the connection() context manager:
+
+            pool = FtprettyPool(host, user, pass, size=4)
+            with pool.connection() as f:
+                f.put('/tmp/data.txt', 'remote/data.txt')
+
+        size: maximum number of connections, idle or in use
+        max_idle: seconds an idle connection is kept before being closed
+        max_lifetime: seconds after which a connection is retired, None for no limit
+        check_after: idle seconds after which a NOOP is sent on checkout
+        factory: callable returning a new ftpretty, kwargs are ignored if set
+    """
+
+    def __init__(self, host, user, password, secure=False, size=4,
+            max_idle=300, max_lifetime=None, check_after=5, factory=None,
+            **kwargs):
+        self.size = size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+
+        if factory is None:
+            def factory():
+                return ftpretty(host, user, password, secure=secure, **kwargs)
+        self.factory = factory
+
+        self._idle = []
+        self._in_use = {}
+        self._count = 0
+        self._closed = False
+        self._lock = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """ Check out a connection for the duration of a with block """
+        ftp = self.acquire(timeout)
+        try:
+            yield ftp
+        except (socket.error, EOFError, error_proto):
+            self.release(ftp, discard=True)
+            raise
+        except BaseException:
+            self.release(ftp)
+            raise
+        else:
+            self.release(ftp)
+
+    def acquire(self, timeout=None):
+        """ Check out a connection, blocking while the pool is exhausted """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            record = self._checkout(deadline)
+            if record is None:
+                try:
+                    ftp = self.factory()
+                    record = _PooledConnection(ftp, ftp.pwd())
+                except Exception:
+                    with self._lock:
+                        self._count -= 1
+                        self._lock.notify()
+                    raise
+                break
+            if self._healthy(record):
+                break
+            self._discard(record)
+
+        record.last_used = time.time()
+        with self._lock:
+            self._in_use[id(record.ftp)] = record
+        return record.ftp
+
+    def release(self, ftp, discard=False):
+        """ Return a connection to the pool, resetting its working directory """
+        with self._lock:
+            record = self._in_use.pop(id(ftp))
+
+        if not discard and not self._closed and not self._expired(record, time.time()):
+            try:
+                ftp.conn.cwd(record.home)
+                ftp.forget_relative_dirs()
+            except Exception:
+                discard = True
+        if discard or self._closed:
+            self._discard(record)
+            return
+
+        record.last_used = time.time()
+        with self._lock:
+            self._idle.append(record)
+            self._lock.notify()
+
+    def evict(self):
+        """ Close idle connections that outlived max_idle or max_lifetime """
+        now = time.time()
+        with self._lock:
+            stale = [r for r in self._idle if self._expired(r, now)]
+            self._idle = [r for r in self._idle if not self._expired(r, now)]
+        for record in stale:
+            self._discard(record)
+        return len(stale)
+
+    def close(self):
+        """ Close idle connections, in use ones are closed when released """
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._lock.notify_all()
+        for record in idle:
+            self._discard(record)
+
+    def _checkout(self, deadline):
+        """ Pop an idle connection, or reserve a slot for a new one (None) """
+        self.evict()
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise RuntimeError('Connection pool is closed')
+                if self._idle:
+                    return self._idle.pop()
+                if self._count < self.size:
+                    self._count += 1
+                    return None
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise RuntimeError('Timed out waiting for a pooled connection')
+                self._lock.wait(remaining)
+
+    def _expired(self, record, now):
+        if self.max_idle is not None and now - record.last_used > self.max_idle:
+            return True
+        if self.max_lifetime is not None and now - record.created > self.max_lifetime:
+            return True
+        return False
+
+    def _healthy(self, record):
+        if self.check_after is None or time.time() - record.last_used < self.check_after:
+            return True
+        return _alive(record.ftp)
+
+    def _discard(self, record):
+        try:
+            record.ftp.close()
+        finally:
+            with self._lock:
+                self._count -= 1
+                self._lock.notify()
+
+
+class TransferManifest(object):
+    """ An SQLite record of the files ftpretty moved, kept across runs
+
+        Attach one to a connection (or pass it to a single call) and put(),
+        get(), upload_tree() and get_tree() skip files whose local copy still
+        matches what was last transferred, by size and mtime or, when only
+        the mtime moved, by content hash:
+
+            manifest = TransferManifest('/var/lib/app/ftp-manifest.db')
+            f = ftpretty(host, user, pass, manifest=manifest)
+            f.upload_tree('/data/export', '/export')
+
+        get_tree() also keeps directory listings and answers from them rather
+        than sending LIST, until a listing is marked stale with mark_stale()
+        or is older than max_age seconds (never by default). Changes made by
+        put(), delete() and rename() on a connection using the manifest are
+        applied to it, changes made by anyone else need mark_stale().
+
+        path: database file, ':memory:' for one process only
+        algorithm: hashlib name of the content hash, None to skip hashing
+    """
+
+    def __init__(self, path, max_age=None, algorithm='sha256'):
+        self.path = path
+        self.max_age = max_age
+        self.algorithm = algorithm
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'remote TEXT PRIMARY KEY, parent TEXT, name TEXT, kind TEXT, '
+                'size INTEGER, modified REAL, '
+                'local TEXT, local_size INTEGER, local_mtime REAL, digest TEXT)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS listings (remote TEXT PRIMARY KEY, listed REAL)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def unchanged(self, remote, local):
+        """ True if local is still the file last transferred as remote """
+        try:
+            info = os.stat(local)
+        except OSError:
+            return False
+        with self._lock:
+            row = self._db.execute(
+                'SELECT local_size, local_mtime, digest FROM entries WHERE remote = ?',
+                (remote,)).fetchone()
+        if row is None or row[0] != info.st_size:
+            return False
+        if row[1] == info.st_mtime:
+            return True
+        if not row[2]:
+            return False
+        algorithm = row[2].split(':', 1)[0]
+        if row[2] != '%s:%s' % (algorithm, _file_digest(local, algorithm)):
+            return False
+        with self._lock, self._db:
+            self._db.execute('UPDATE entries SET local_mtime = ? WHERE remote = ?',
+                             (info.st_mtime, remote))
+        return True
+
+    def record(self, remote, local, size=None):
+        """ Remember that local was transferred as remote """
+        info = os.stat(local)
+        digest = None
+        if self.algorithm:
+            digest = '%s:%s' % (self.algorithm, _file_digest(local, self.algorithm))
+        parent, name = posixpath.split(remote)
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR IGNORE INTO entries (remote, parent, name, kind) '
+                'VALUES (?, ?, ?, ?)', (remote, parent, name, '-'))
+            self._db.execute(
+                'UPDATE entries SET size = ?, local = ?, local_size = ?, '
+                'local_mtime = ?, digest = ? WHERE remote = ?',
+                (info.st_size if size is None else size, local, info.st_size,
+                 info.st_mtime, digest, remote))
+
+    def size(self, remote):
+        """ The recorded size of a remote file, None if unknown """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT size FROM entries WHERE remote = ?', (remote,)).fetchone()
+        return row and row[0]
+
+    def fresh(self, remote):
+        """ True if the listing kept for a remote directory can be used """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT listed FROM listings WHERE remote = ?', (remote,)).fetchone()
+        if row is None or row[0] is None:
+            return False
+        return self.max_age is None or time.time() - row[0] < self.max_age
+
+    def listing(self, remote):
+        """ The entries kept for a remote directory, None if stale or unknown """
+        if not self.fresh(remote):
+            return None
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT name, kind, size FROM entries WHERE parent = ? ORDER BY name',
+                (remote,)).fetchall()
+        return [FileEntry(flags=kind, size=size, name=name) for name, kind, size in rows]
+
+    def store_listing(self, remote, entries):
+        """ Keep the listing of a remote directory
+
+            Files whose size or time changed on the server are no longer
+            considered unchanged, entries that are gone are forgotten.
+        """
+        names = set()
+        with self._lock, self._db:
+            for entry in entries:
+                if entry.name in ftpretty.relative_paths:
+                    continue
+                names.add(entry.name)
+                path = posixpath.join(remote, entry.name)
+                modified = _timestamp(entry.datetime)
+                row = self._db.execute(
+                    'SELECT size, modified FROM entries WHERE remote = ?', (path,)).fetchone()
+                if row is None:
+                    self._db.execute(
+                        'INSERT INTO entries (remote, parent, name, kind, size, modified) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (path, remote, entry.name, entry.flags, entry.size, modified))
+                elif row[0] != entry.size or row[1] is not None and row[1] != modified:
+                    self._db.execute(
+                        'UPDATE entries SET kind = ?, size = ?, modified = ?, '
+                        'local_size = NULL, local_mtime = NULL, digest = NULL '
+                        'WHERE remote = ?', (entry.flags, entry.size, modified, path))
+                else:
+                    self._db.execute(
+                        'UPDATE entries SET kind = ?, modified = ? WHERE remote = ?',
+                        (entry.flags, modified, path))
+            known = self._db.execute(
+                'SELECT name FROM entries WHERE parent = ?', (remote,)).fetchall()
+            for name, in known:
+                if name not in names:
+                    self._forget(posixpath.join(remote, name))
+            self._db.execute('INSERT OR REPLACE INTO listings (remote, listed) VALUES (?, ?)',
+                             (remote, time.time()))
+
+    def mark_stale(self, remote):
+        """ List a remote directory, and the ones below it, again next time """
+        prefix = remote.rstrip('/') + '/'
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE listings SET listed = NULL WHERE remote = ? OR substr(remote, 1, ?) = ?',
+                (remote, len(prefix), prefix))
+
+    def forget(self, remote):
+        """ Drop what is known about a remote path and everything below it """
+        with self._lock, self._db:
+            self._forget(remote)
+
+    def _forget(self, remote):
+        prefix = remote.rstrip('/') + '/'
+        for table in ('entries', 'listings'):
+            self._db.execute(
+                'DELETE FROM %s WHERE remote = ? OR substr(remote, 1, ?) = ?' % table,
+                (remote, len(prefix), prefix))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ListingCache(object):
+    """ A TTL and LRU bounded cache of list() and stat() results
+
+        Opt in per connection, or share one between the connections of a pool:
+
+            cache = ListingCache(ttl=60)
+            f = ftpretty(host, user, pass, cache=cache)
+            pool = FtprettyPool(host, user, pass, cache=cache)
+
+        Results are kept by absolute path, so lookups of relative paths still
+        send a PWD but no LIST, MLSD or MLST. put(), delete(), rename(),
+        mkdir(), makedirs() and upload_tree() drop the entries of the paths
+        they touch and of their parent directories.
+
+        ttl: seconds a result is used for, None to keep it until evicted
+        size: number of results kept, the least recently used go first
+        hits, misses: lookups answered from the cache and from the server
+    """
+
+    def __init__(self, ttl=30, size=1024):
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by invalidations, results computed across one aren't kept
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def fetch(self, key, compute):
+        """ The cached value for key, calling compute() on a miss
+
+            key is a tuple whose second item is the absolute remote path.
+        """
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item is not None and (self.ttl is None or time.time() - item[0] < self.ttl):
+                self._entries[key] = item  # most recently used
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+            generation = self._generation
+        value = compute()
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (time.time(), value)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, remote):
+        """ Drop results for an absolute remote path, its parent and below it """
+        remote = posixpath.normpath(remote)
+        parent = posixpath.dirname(remote)
+        prefix = remote.rstrip('/') + '/'
+        with self._lock:
+            self._generation += 1
+            for key in list(self._entries):
+                path = key[1]
+                if path == remote or path == parent or path.startswith(prefix):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+class Batch(object):
+    """ Control commands sent back to back, their replies matched in order
+
+        Build one with ftpretty.batch() and chain the calls:
+
+            results = f.batch().delete('a.txt').rename('b.txt', 'c.txt').size('d.txt').execute()
+
+        Up to window commands are on the wire at a time, instead of waiting a
+        round trip for every reply. Servers that lose commands sent ahead
+        surface as a timeout (set one on the connection) or a garbled reply:
+        the session is then reconnected and the rest of the batch, and every
+        later one, goes in lockstep.
+    """
+
+    def __init__(self, ftp, window):
+        if window < 1:
+            raise ValueError('window must be at least 1')
+        self.ftp = ftp
+        self.window = window
+        self._ops = []
+        self._received = 0
+
+    def __len__(self):
+        return len(self._ops)
+
+    def delete(self, remote):
+        """ DELE a file, the result is the server's reply """
+        return self._add(['DELE %s' % remote], None, lambda: self.ftp._removed(remote))
+
+    def rmd(self, remote):
+        """ RMD an empty directory, the result is the server's reply """
+        return self._add(['RMD %s' % remote], None, lambda: self.ftp._removed(remote, True))
+
+    def mkdir(self, remote):
+        """ MKD a directory, the result is the server's reply """
+        return self._add(['MKD %s' % remote], None, lambda: self.ftp._created(remote))
+
+    def rename(self, remote_from, remote_to):
+        """ RNFR and RNTO, the result is the reply to RNTO """
+        return self._add(['RNFR %s' % remote_from, 'RNTO %s' % remote_to], None,
+                         lambda: self.ftp._renamed(remote_from, remote_to))
+
+    def size(self, remote):
+        """ SIZE of a file, the result is an int """
+        return self._add(['SIZE %s' % remote], lambda resp: int(resp.split()[1]))
+
+    def mdtm(self, remote):
+        """ MDTM of a file, the result is a UTC datetime """
+        return self._add(['MDTM %s' % remote], _parse_mdtm)
+
+    def command(self, line):
+        """ Any other command, the result is the server's reply """
+        return self._add([line])
+
+    def _add(self, lines, parse=None, after=None):
+        for line in lines:
+            if '\r' in line or '\n' in line:
+                raise ValueError('an illegal newline character should not be contained')
+        self._ops.append((lines, parse, after))
+        return self
+
+    def execute(self):
+        """ Send the commands and return their results, in the order added
+
+            A command the server refuses has the error_perm, error_temp or
+            error_reply exception as its result, the others still run.
+        """
+        ops, self._ops = self._ops, []
+        lines = [(index, line) for index, op in enumerate(ops) for line in op[0]]
+        replies = [[] for _ in ops]
+        ftp = self.ftp
+        window = self.window if ftp.pipelining else 1
+        cwd = ftp.conn.pwd() if window > 1 and ftp._connect_args is not None else None
+        self._received = 0
+        try:
+            self._exchange(lines, replies, window)
+        except (socket.error, EOFError, error_proto):
+            if window == 1 or not ftp.reconnect():
+                raise
+            if cwd is not None:
+                ftp.conn.cwd(cwd)
+            ftp.pipelining = False
+            # redo the command that was cut short from its first line
+            index = lines[self._received][0]
+            replies[index] = []
+            self._received = [i for i, _ in lines].index(index)
+            self._exchange(lines, replies, 1)
+
+        results = []
+        for (_, parse, after), op_replies in zip(ops, replies):
+            errors = [reply for reply in op_replies if isinstance(reply, Exception)]
+            if errors:
+                results.append(errors[0])
+                continue
+            results.append(parse(op_replies[-1]) if parse else op_replies[-1])
+            if after is not None:
+                after()
+        return results
+
+    def _exchange(self, lines, replies, window):
+        """ Keep up to window lines unanswered until every line has its reply """
+        sent = self._received
+        while self._received < len(lines):
+            if sent < len(lines) and sent - self._received < window:
+                chunk = lines[sent:self._received + window]
+                self.ftp._send_lines([line for _, line in chunk])
+                sent += len(chunk)
+            index = lines[self._received][0]
+            try:
+                replies[index].append(self.ftp.conn.getresp())
+            except (error_reply, error_temp, error_perm) as why:
+                replies[index].append(why)
+            self._received += 1
+
+
+class _DownloadStream(object):
+    """ File-like reader over a RETR data connection, see ftpretty.get_stream """
+
+    def __init__(self, conn, sock, chunk_size):
+        self.conn = conn
+        self.sock = sock
+        self.chunk_size = chunk_size
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        """ Read up to size bytes, everything that is left if size is negative """
+        if self.closed:
+            return b''
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(self.chunk_size)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        if size == 0:
+            # recv(0) returns b'' too, which would look like the end of data
+            return b''
+        data = self.sock.recv(size)
+        if not data:
+            self._finish()
+        return data
+
+    def readinto(self, buf):
+        if self.closed or not len(buf):
+            return 0
+        size = self.sock.recv_into(buf)
+        if not size:
+            self._finish()
+        return size
+
+    def _finish(self):
+        """ All data arrived, shut down and check the transfer reply """
+        if hasattr(self.sock, 'unwrap'):
+            self.sock.unwrap()
+        self.sock.close()
+        self.closed = True
+        self.conn.voidresp()
+
+    def close(self):
+        """ Stop reading, abandoning whatever hasn't arrived yet """
+        if self.closed:
+            return
+        self.closed = True
+        self.sock.close()
+        try:
+            self.conn.voidresp()
+        except Exception:
+            pass
+
+
+class _ChunkReader(object):
+    """ File-like reader over an iterable of bytes chunks """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b''
+        self._pos = 0
+
+    def read(self, size=-1):
+        """ Read up to size bytes, never more than what is left of one chunk """
+        if size is None or size < 0:
+            rest = [self._chunk[self._pos:]]
+            rest.extend(self._chunks)
+            self._chunk, self._pos = b'', 0
+            return b''.join(rest)
+        while self._pos >= len(self._chunk):
+            try:
+                self._chunk = next(self._chunks)
+            except StopIteration:
+                return b''
+            self._pos = 0
+        data = self._chunk[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        close = getattr(self._chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class _CountingWriter(object):
+    """ Callback for retrbinary counting the bytes it writes """
+
+    def __init__(self, write, count=0):
+        self.write = write
+        self.count = count
+
+    def __call__(self, data):
+        self.write(data)
+        self.count += len(data)
+
+
+class _BlockSize(object):
+    """ Transfer block size, fixed or adaptive
+
+        With 'auto' the size starts at start and doubles after every window of
+        sample_time seconds that moved data at least 10% faster than the best
+        window so far, up to maximum. The first window that doesn't settles it.
+    """
+    start = 8192
+    maximum = 4 << 20
+    sample_time = 0.05
+
+    def __init__(self, blocksize):
+        if blocksize != 'auto' and (not isinstance(blocksize, int) or blocksize < 1):
+            raise ValueError("blocksize must be a positive int or 'auto', not %r" % (blocksize,))
+        self.adaptive = blocksize == 'auto'
+        self.size = self.start if self.adaptive else blocksize
+        # largest size this can grow to, for preallocating buffers
+        self.capacity = self.maximum if self.adaptive else blocksize
+        self.settled = not self.adaptive
+        self._best = 0
+        self._count = 0
+        self._since = time.time()
+
+    def update(self, count):
+        """ Record count bytes moved, returns the size of the next block """
+        if self.settled:
+            return self.size
+        self._count += count
+        now = time.time()
+        elapsed = now - self._since
+        if elapsed >= self.sample_time and elapsed > 0:
+            rate = self._count / elapsed
+            if rate > self._best * 1.1 and self.size < self.maximum:
+                self._best = rate
+                self.size = min(self.size * 2, self.maximum)
+            else:
+                self.settled = True
+            self._count = 0
+            self._since = now
+        return self.size
+
+
+class _TransferReader(object):
+    """ File wrapper counting (and optionally hashing) what is read through it """
+
+    def __init__(self, fp, algorithm=None, blocks=None):
+        self.fp = fp
+        self.algorithm = algorithm
+        self.blocks = blocks or _BlockSize(8192)
+        try:
+            self.start = fp.tell()
+        except Exception:
+            self.start = None
+        self._reset()
+
+    def _reset(self):
+        self.count = 0
+        if self.algorithm == 'crc32':
+            self._crc = 0
+        elif self.algorithm:
+            self._hash = hashlib.new(self.algorithm)
+
+    def seek(self, offset):
+        """ Continue from offset bytes into the source, hashing what is skipped """
+        if self.start is None:
+            raise ValueError('Cannot resume an upload from an unseekable source')
+        self.fp.seek(self.start)
+        self._reset()
+        if not self.algorithm:
+            self.fp.seek(self.start + offset)
+            self.count = offset
+            return
+        while self.count < offset:
+            if not self.read(min(offset - self.count, 65536)):
+                break
+
+    def sendfile(self, sock):
+        """ Send the rest of the file with sock.sendfile, one block per call """
+        while True:
+            sent = sock.sendfile(self.fp, self.fp.tell(), self.blocks.size)
+            if not sent:
+                break
+            self.count += sent
+            self.blocks.update(sent)
+
+    def read(self, size=-1):
+        if size is not None and size > 0 and self.blocks.adaptive:
+            # storbinary keeps asking for the size it was called with
+            size = self.blocks.size
+        data = self.fp.read(size)
+        self.blocks.update(len(data))
+        self.count += len(data)
+        if self.algorithm == 'crc32':
+            self._crc = zlib.crc32(data, self._crc) & 0xffffffff
+        elif self.algorithm:
+            self._hash.update(data)
+        return data
+
+    def hexdigest(self):
+        if self.algorithm == 'crc32':
+            return '%08x' % self._crc
+        return self._hash.hexdigest()
+
+    def close(self):
+        self.fp.close()
+
+
+class _TaskPool(object):
+    """ Run tasks from a shared queue on pooled connections
+
+        handler(ftp, task) is called from worker threads that each hold one
+        connection, and may submit() follow-up tasks. Exceptions don't stop
+        the other tasks and are collected in errors as (task, exception).
+
+        Workers only start with connections that are free right away, so a
+        caller holding connections of the same pool can't deadlock it. When
+        none is free the tasks run on the fallback connection instead, without
+        one start() returns False and the caller has to do without the pool.
+    """
+
+    def __init__(self, pool, workers, handler, fallback=None):
+        self.pool = pool
+        self.workers = max(1, workers)
+        self.handler = handler
+        self.fallback = fallback
+        self.errors = []
+        self.stopped = False
+        self._tasks = Queue()
+        self._pending = 0
+        self._threads = []
+        self._lock = threading.Condition()
+
+    def submit(self, task):
+        with self._lock:
+            self._pending += 1
+        self._tasks.put(task)
+
+    def start(self):
+        """ Start the workers, False if there is neither a free connection nor a fallback """
+        connections = self._reserve()
+        pooled = bool(connections)
+        if not pooled:
+            if self.fallback is None:
+                return False
+            connections = [self.fallback]
+        for ftp in connections:
+            thread = threading.Thread(target=self._work, args=(ftp, pooled))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return True
+
+    def join(self):
+        """ Wait until every submitted task, and the tasks it submitted, is done """
+        with self._lock:
+            while self._pending:
+                self._lock.wait()
+
+    def stop(self):
+        """ Skip queued tasks and shut the workers down """
+        self.stopped = True
+        for _ in self._threads:
+            self._tasks.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def run(self, tasks):
+        """ Run tasks and everything they submit, returning the errors """
+        self.start()
+        try:
+            for task in tasks:
+                self.submit(task)
+            self.join()
+        finally:
+            self.stop()
+        return self.errors
+
+    def _reserve(self):
+        """ Check out up to workers connections without waiting """
+        connections = []
+        try:
+            while len(connections) < self.workers:
+                connections.append(self.pool.acquire(timeout=0))
+        except RuntimeError:
+            pass
+        except Exception:
+            for ftp in connections:
+                self.pool.release(ftp)
+            raise
+        return connections
+
+    def _work(self, ftp, pooled):
+        while True:
+            task = self._tasks.get()
+            if task is _STOP:
+                break
+            try:
+                if not self.stopped:
+                    if ftp is None:
+                        # the slot of the dead connection was freed, don't wait
+                        # for one while holding a task
+                        ftp = self.pool.acquire(timeout=0)
+                    self.handler(ftp, task)
+            except Exception as why:
+                with self._lock:
+                    self.errors.append((task, why))
+                if pooled and ftp is not None and not _alive(ftp):
+                    self.pool.release(ftp, discard=True)
+                    ftp = None
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    if not self._pending:
+                        self._lock.notify_all()
+        if pooled and ftp is not None:
+            self.pool.release(ftp)
+
+
+_pwrite_lock = threading.Lock()
+
+
+def _pwrite(fd, data, offset):
+    """ Write all of data at offset without moving a shared file position """
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            with _pwrite_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+def _writable_view(target):
+    """ A flat writable byte memoryview of target, None if it isn't a buffer """
+    try:
+        view = memoryview(target)
+    except TypeError:
+        return None
+    if view.readonly:
+        return None
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
+def _scan_local(local):
+    """ Return (dirs, files) below local, relative posix paths with files mapped to os.stat """
+    dirs, files = set(), {}
+    for root, dirnames, filenames in os.walk(local):
+        rel = os.path.relpath(root, local).replace(os.sep, '/')
+        rel = '' if rel == '.' else rel
+        for name in list(dirnames):
+            if os.path.islink(os.path.join(root, name)):
+                dirnames.remove(name)
+            else:
+                dirs.add(posixpath.join(rel, name))
+        for name in filenames:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                files[posixpath.join(rel, name)] = os.stat(path)
+    return dirs, files
+
+
+def _local_join(local, path):
+    return os.path.join(local, *path.split('/'))
+
+
+def _deletions(remote, local, target_files, source_files, target_dirs, source_dirs,
+               every_dir=False):
+    """ Plan the removal of target files and directories missing from the source
+
+        Only the topmost extra directories are planned, for shutil.rmtree,
+        unless every_dir is set: RMD needs each one empty, deepest first.
+    """
+    plan = []
+    for path in sorted(set(target_files) - set(source_files)):
+        plan.append(('delete', posixpath.join(remote, path), _local_join(local, path)))
+    extra_dirs = target_dirs - source_dirs
+    for path in sorted(extra_dirs, reverse=True):
+        if every_dir or posixpath.dirname(path) not in extra_dirs:
+            plan.append(('rmdir', posixpath.join(remote, path), _local_join(local, path)))
+    return plan
+
+
+def _timestamp(value):
+    """ Seconds since the epoch of a listing datetime, naive ones are local time """
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+    return time.mktime(value.timetuple()) + value.microsecond / 1e6
+
+
+def _precision(entry):
+    """ Seconds a listing entry's time may be rounded down by """
+    if entry.datetime is not None and entry.datetime.tzinfo is not None:
+        return 1
+    if entry.time == '00:00':  # LIST shows a year instead of the time
+        return 86400
+    return 60
+
+
+def _file_digest(path, algorithm):
+    """ Hex digest of a local file, algorithm is a hashlib name or 'crc32' """
+    reader = _TransferReader(open(path, 'rb'), algorithm)
+    try:
+        while reader.read(65536):
+            pass
+    finally:
+        reader.close()
+    return reader.hexdigest()
+
+
+def _parse_mdtm(resp):
+    """ The UTC datetime of a "213 YYYYMMDDHHMMSS[.sss]" MDTM reply """
+    value = resp.split()[1]
+    return datetime.datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                             int(value[8:10]), int(value[10:12]), int(value[12:14]),
+                             int(value[15:21].ljust(6, '0')) if len(value) > 15 else 0,
+                             _UTC)
+
+
+def _check_verify(verify):
+    if verify not in _VERIFY_MODES:
+        raise ValueError('Unknown verify mode %r, expected one of %r' % (verify, _VERIFY_MODES))
+
+
+def _alive(ftp):
+    """ Check a connection still answers on the control channel """
+    try:
+        ftp.conn.voidcmd('NOOP')
+    except Exception:
+        return False
+    return True
+
+
+def _mode_to_perms(mode):
+    """ Turn an octal unix.mode fact such as 0755 into rwxr-xr-x """
+    mode = int(mode, 8)
+    perms = ''
+    for shift in (6, 3, 0):
+        bits = mode >> shift
+        perms += ('r' if bits & 4 else '-') + ('w' if bits & 2 else '-') + ('x' if bits & 1 else '-')
+    return perms
+
+
+_UTC = tzutc()
+
+
+def _parse_mlsd_line(line, keep_relative=False):
+    """ Parse one MLSD/MLST line, returns None for . and .. unless keep_relative """
+    # facts end with "; ", fact values (e.g. UNIX.owner) may contain spaces
+    facts, _, name = line.rstrip('\r\n').partition('; ')
+    fact_map = {}
+    for fact in facts.split(';'):
+        key, _, value = fact.partition('=')
+        if key:
+            fact_map[key.lower()] = value
+
+    kind = fact_map.get('type', '').lower()
+    if kind in ('cdir', 'pdir') and not keep_relative:
+        return None
+    if kind in ('dir', 'cdir', 'pdir'):
+        flags = 'd'
+    elif kind == 'file':
+        flags = '-'
+    elif 'slink' in kind or 'symlink' in kind:
+        flags = 'l'
+    else:
+        flags = None
+
+    size = fact_map.get('size', fact_map.get('sizd'))
+    mode = fact_map.get('unix.mode')
+    stamp = date = time_ = year = None
+    if 'modify' in fact_map:
+        # YYYYMMDDHHMMSS[.sss], always UTC
+        modify = fact_map['modify']
+        stamp = (int(modify[0:4]), int(modify[4:6]), int(modify[6:8]),
+                 int(modify[8:10]), int(modify[10:12]), int(modify[12:14]),
+                 int(modify[15:21].ljust(6, '0')) if len(modify) > 15 else 0,
+                 _UTC)
+        date = '%s %d' % (_MONTH_NAMES[stamp[1] - 1], stamp[2])
+        time_ = '%02d:%02d' % stamp[3:5]
+        year = modify[0:4]
+
+    return FileEntry(
+        flags=flags,
+        perms=_mode_to_perms(mode) if mode else None,
+        owner=fact_map.get('unix.owner', fact_map.get('unix.uid')),
+        group=fact_map.get('unix.group', fact_map.get('unix.gid')),
+        size=int(size) if size else None,
+        date=date,
+        time=time_,
+        year=year,
+        name=name,
+        unique=fact_map.get('unique'),
+        stamp=stamp)
+
+
+def split_mlsd_info(lines):
+    """ Parse MLSD output into the same entries as split_file_info
+
+        Modification times are exact and in UTC, . and .. are skipped.
+    """
+    files = []
+    for line in lines:
+        entry = _parse_mlsd_line(line)
+        if entry is not None:
+            files.append(entry)
+    return files
+
+
+_UNIX_FORMAT = re.compile(
+    r'^([\-dbclps])' +                  # Directory flag [1]
+    r'((?:[r-][w-][-xsStT]){3})\s+' +   # Permissions [2]
+    r'(\d+)\s+' +                       # Number of items [3]
+    r'([a-zA-Z0-9_-]+)\s+' +            # File owner [4]
+    r'([a-zA-Z0-9_-]+)\s+' +            # File group [5]
+    r'(\d+)\s+' +                       # File size in bytes [6]
+    r'(\w{3}\s+\d{1,2})\s+' +           # 3-char month and 1/2-char day of the month [7]
+    r'(\d{1,2}:\d{1,2}|\d{4})\s+' +     # Time or year (need to check conditions) [+= 7]
+    r'(.+)$'                            # File/directory name [8]
+)
+
+# not exactly sure what format this, but seems windows-esque
+# attempting to address issue: https://github.com/codebynumbers/ftpretty/issues/34
+# can get better results with more data.
+_WINDOWS_FORMAT = re.compile(
+    r'(\d{2})-(\d{2})-(\d{2})\s+' +     # month/day/2-digit year (assuming after 2000)
+    r'(\d{2}):(\d{2})([AP])M\s+' +      # time
+    r'(\d+)\s+' +                       # file size
+    r'(.+)$'                            # filename
+)
+
+_MONTHS = dict((name.lower(), number) for number, name in enumerate(_MONTH_NAMES, 1))
+
+
+class _ListingParser(object):
+    """ Parses LIST lines one at a time
+
+        One "now" is used to guess the year of every recent entry in a listing,
+        and (date, time or year) conversions are memoized.
+    """
+
+    def __init__(self, now=None):
+        self.now = now or datetime.datetime.now()
+        self._stamps = {}
+
+    def parse(self, line):
+        """ Return the entry for a line, or None if the format isn't recognized """
+        match = _UNIX_FORMAT.match(line)
+        if match:
+            parts = match.groups()
+            date, stamp = parts[6], parts[7]
+            try:
+                year, time_, args = self._stamps[(date, stamp)]
+            except KeyError:
+                year, time_, args = self._stamps[(date, stamp)] = self._stamp(date, stamp)
+
+            return FileEntry(
+                flags=parts[0],
+                perms=parts[1],
+                items=parts[2],
+                owner=parts[3],
+                group=parts[4],
+                size=int(parts[5]),
+                date=date,
+                time=time_,
+                year=year,
+                name=parts[8],
+                stamp=args)
+
+        match = _WINDOWS_FORMAT.match(line)
+        if match:
+            parts = (None,) + match.groups()
+
+            hour = int(parts[4])
+            hour += 12 if parts[6] == 'P' else 0
+            hour = 0 if hour == 24 else hour
+            year = int(parts[3]) + 2000
+
+            return FileEntry(
+                size=int(parts[7]),
+                date="{}-{}-{}".format(*parts[1:4]),
+                time="{}:{}{}".format(*parts[4:7]),
+                year=year,
+                name=parts[8],
+                stamp=(year, int(parts[1]), int(parts[2]), hour, int(parts[5]), 0))
+
+        return None
+
+    def _stamp(self, date, stamp):
+        """ Return (year, time, datetime arguments) for a date and a time or year """
+        month_name, day = date.split()
+        month = _MONTHS.get(month_name.lower())
+        if month is None:
+            month = parser.parse(month_name).month
+        day = int(day)
+
+        if ':' in stamp:
+            hour, minute = [int(n) for n in stamp.split(':')]
+            year = self._year(month, day)
+            return str(year), stamp, (year, month, day, hour, minute)
+        return stamp, '00:00', (int(stamp), month, day)
+
+    def _year(self, month, day):
+        """ Recent entries have no year, it is the latest one not in the future """
+        year = self.now.year
+        while True:
+            try:
+                if self.now > datetime.datetime(year, month, day):
+                    return year
+            except ValueError:  # Feb 29 outside a leap year
+                pass
+            year -= 1
+
+
+def split_file_info(fileinfo, now=None):
+    """ Parse sane directory output usually ls -l
+        Adapted from https://gist.github.com/tobiasoberrauch/2942716
+
+        now is the reference used to guess the year of recent entries.
+    """
+    listing_parser = _ListingParser(now)
+    files = []
+    for line in fileinfo:
+        entry = listing_parser.parse(line)
+        if entry is not None:
+            files.append(entry)
     return files
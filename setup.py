@@ -43,7 +43,7 @@ setup(
     author_email='harrigan.rob@gmail.com',
     url='https://github.com/codebynumbers/ftpretty/',
     download_url='https://github.com/codebynumbers/ftpretty/tarball/%s' % __version__,
-    py_modules=['ftpretty','compat'],
+    py_modules=['ftpretty', 'aioftpretty', 'compat'],
     install_requires = [
         'python-dateutil',
     ],
@@ -0,0 +1,208 @@
+import asyncio
+import os
+import posixpath
+import time
+
+
+class AioFTPServer(object):
+    """ Minimal in-process asyncio FTP server over a local directory, for tests """
+
+    def __init__(self, root):
+        self.root = root
+        self.commands = []
+        self.sessions = 0
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._session, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _session(self, reader, writer):
+        self.sessions += 1
+        await _Session(self, reader, writer).run()
+
+
+class _Session(object):
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.cwd = '/'
+        self.rest = None
+        self.rename_from = None
+        self.data = None
+
+    async def reply(self, line):
+        self.writer.write((line + '\r\n').encode('utf-8'))
+        await self.writer.drain()
+
+    async def run(self):
+        await self.reply('220 ready')
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            cmd, _, arg = line.decode('utf-8').rstrip('\r\n').partition(' ')
+            cmd = cmd.upper()
+            self.server.commands.append(cmd)
+            handler = getattr(self, 'ftp_' + cmd.lower(), None)
+            if handler is None:
+                await self.reply('502 {} not implemented'.format(cmd))
+                continue
+            try:
+                await handler(arg)
+            except OSError as why:
+                await self.reply('550 {}'.format(why.strerror))
+            if cmd == 'QUIT':
+                break
+        self.writer.close()
+
+    def path(self, arg):
+        return posixpath.normpath(posixpath.join(self.cwd, arg or '.'))
+
+    def local(self, arg):
+        return os.path.join(self.server.root, self.path(arg).lstrip('/'))
+
+    async def ftp_user(self, arg):
+        await self.reply('331 password please')
+
+    async def ftp_pass(self, arg):
+        await self.reply('230 logged in')
+
+    async def ftp_type(self, arg):
+        await self.reply('200 type set')
+
+    async def ftp_noop(self, arg):
+        await self.reply('200 OK')
+
+    async def ftp_quit(self, arg):
+        await self.reply('221 bye')
+
+    async def ftp_pwd(self, arg):
+        await self.reply('257 "{}"'.format(self.cwd))
+
+    async def ftp_cwd(self, arg):
+        if not os.path.isdir(self.local(arg)):
+            await self.reply('550 no such directory')
+            return
+        self.cwd = self.path(arg)
+        await self.reply('250 OK')
+
+    async def ftp_size(self, arg):
+        if not os.path.isfile(self.local(arg)):
+            await self.reply('550 no such file')
+            return
+        await self.reply('213 {}'.format(os.path.getsize(self.local(arg))))
+
+    async def ftp_mkd(self, arg):
+        os.mkdir(self.local(arg))
+        await self.reply('257 "{}" created'.format(self.path(arg)))
+
+    async def ftp_rmd(self, arg):
+        os.rmdir(self.local(arg))
+        await self.reply('250 removed')
+
+    async def ftp_dele(self, arg):
+        if not os.path.isfile(self.local(arg)):
+            await self.reply('550 not a file')
+            return
+        os.remove(self.local(arg))
+        await self.reply('250 deleted')
+
+    async def ftp_rnfr(self, arg):
+        self.rename_from = self.local(arg)
+        await self.reply('350 ready for RNTO')
+
+    async def ftp_rnto(self, arg):
+        os.rename(self.rename_from, self.local(arg))
+        await self.reply('250 renamed')
+
+    async def ftp_rest(self, arg):
+        self.rest = int(arg)
+        await self.reply('350 restarting at {}'.format(arg))
+
+    async def ftp_epsv(self, arg):
+        port = await self.listen()
+        await self.reply('229 Entering Extended Passive Mode (|||{}|)'.format(port))
+
+    async def ftp_pasv(self, arg):
+        port = await self.listen()
+        await self.reply('227 Entering Passive Mode (127,0,0,1,{},{})'.format(port >> 8, port & 255))
+
+    async def listen(self):
+        connected = asyncio.get_event_loop().create_future()
+
+        def accept(reader, writer):
+            if not connected.done():
+                connected.set_result((reader, writer))
+
+        server = await asyncio.start_server(accept, '127.0.0.1', 0)
+        self.data = (server, connected)
+        return server.sockets[0].getsockname()[1]
+
+    async def open_data(self):
+        server, connected = self.data
+        self.data = None
+        reader, writer = await connected
+        server.close()
+        await self.reply('150 opening data connection')
+        return reader, writer
+
+    async def ftp_retr(self, arg):
+        if not os.path.isfile(self.local(arg)):
+            await self.reply('550 no such file')
+            return
+        offset, self.rest = self.rest or 0, None
+        reader, writer = await self.open_data()
+        with open(self.local(arg), 'rb') as f:
+            f.seek(offset)
+            writer.write(f.read())
+        await writer.drain()
+        writer.close()
+        await self.reply('226 transfer complete')
+
+    async def ftp_stor(self, arg):
+        offset, self.rest = self.rest, None
+        reader, writer = await self.open_data()
+        with open(self.local(arg), 'r+b' if offset else 'wb') as f:
+            if offset:
+                f.seek(offset)
+                f.truncate()
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                f.write(data)
+        writer.close()
+        await self.reply('226 transfer complete')
+
+    async def ftp_list(self, arg):
+        await self.send_lines(arg, self.list_line)
+
+    async def ftp_nlst(self, arg):
+        await self.send_lines(arg, lambda path, name: name)
+
+    async def send_lines(self, arg, format_line):
+        path = self.local(arg)
+        if not os.path.isdir(path):
+            await self.reply('550 no such directory')
+            return
+        reader, writer = await self.open_data()
+        for name in sorted(os.listdir(path)):
+            writer.write((format_line(os.path.join(path, name), name) + '\r\n').encode('utf-8'))
+        await writer.drain()
+        writer.close()
+        await self.reply('226 transfer complete')
+
+    def list_line(self, path, name):
+        info = os.stat(path)
+        flags = 'd' if os.path.isdir(path) else '-'
+        stamp = time.strftime('%b %d %H:%M', time.localtime(info.st_mtime))
+        return '{}rw-r--r-- 1 owner group {} {} {}'.format(flags, info.st_size, stamp, name)
@@ -1,69 +1,202 @@
+import fnmatch
+import hashlib
+import io
 import os
+import posixpath
+import socket
+import zlib
+from ftplib import error_perm, error_proto, error_temp
+from fs.errors import DirectoryExists, FSError
 from fs.memoryfs import MemoryFS
 from compat import stringtype
 
+class MockSocket(object):
+    """ Mock data connection, on_close receives what was sent """
+
+    def __init__(self, data=b'', on_close=None):
+        self._incoming = io.BytesIO(data)
+        self._sent = io.BytesIO()
+        self.on_close = on_close
+        self.closed = False
+
+    def makefile(self, mode='r', encoding=None):
+        data = io.BytesIO(self._incoming.read())
+        if 'b' in mode:
+            return data
+        return io.TextIOWrapper(data, encoding=encoding or 'utf-8', newline='')
+
+    def recv(self, size):
+        return self._incoming.read(size)
+
+    def recv_into(self, buf, nbytes=0):
+        return self._incoming.readinto(memoryview(buf)[:nbytes or len(buf)])
+
+    def sendall(self, data):
+        self._sent.write(data)
+
+    def sendfile(self, file, offset=0, count=None):
+        file.seek(offset)
+        data = file.read(count) if count else file.read()
+        self._sent.write(data)
+        file.seek(offset + len(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.on_close:
+                self.on_close(self._sent.getvalue())
+
+
+class MockControlSocket(object):
+    """ Mock control connection, each line written is answered in order """
+
+    def __init__(self, ftp):
+        self.ftp = ftp
+        self.writes = 0
+
+    def sendall(self, data):
+        self.writes += 1
+        lines = data.decode(self.ftp.encoding).split('\r\n')[:-1]
+        if not self.ftp.pipelining_supported:
+            # like servers that drop whatever arrives after the first command
+            lines = lines[:1]
+        for line in lines:
+            self.ftp._replies.append(self.ftp._control(line))
+
+
 class MockFTP(object):
     """ Mock FTP lib for testing """
 
-    def __init__(self):
-        self.mfs = MemoryFS()
+    encoding = 'utf-8'
+
+    def __init__(self, mfs=None, rooted=False):
+        self.mfs = mfs or MemoryFS()
+        self.rooted = rooted
         self._stack = []
+        self.closed = False
+        self.log = []
+        self.features = []
+        self.corrupt = False
+        self.transfers = 0
+        self.drop_transfers = 0
+        self.rest_supported = True
+        self.rest = None
+        self.stored = []
+        self.streamed = []
+        self._dropped = False
+        self._replies = []
+        self._rename_from = None
+        self.pipelining_supported = True
+        self.sock = MockControlSocket(self)
 
     def _getpath(self, path):
         path = stringtype(path)
         return os.path.join(self.pwd(), path)
 
-    def storbinary(self, command, f):
-        cmd, path = command.split(' ')
+    def _drop(self, data):
+        """ Cut a transfer short halfway when asked to simulate a failure """
+        if self.drop_transfers:
+            self.drop_transfers -= 1
+            return data[:len(data) // 2], True
+        return data, False
+
+    def storbinary(self, command, f, blocksize=8192, callback=None, rest=None):
+        self.stored.append(command)
+        data = b''.join(iter(lambda: f.read(blocksize), b''))
+        if self._store(command, data, rest):
+            raise EOFError()
+        return '226 Transfer complete'
+
+    def _store(self, command, data, rest):
+        """ Write what a STOR/APPE sent, True if the transfer was dropped """
+        cmd, _, path = command.partition(' ')
         path = self._getpath(path)
-        with self.mfs.openbin(path, 'w') as fh:
-            fh.write(f.read())
-        return self.mfs.getinfo(path, namespaces='details').size
+        data, dropped = self._drop(data)
+        if self.corrupt:
+            data = data[:-1]
+        existing = b''
+        if self.mfs.exists(path) and (rest or cmd == 'APPE'):
+            existing = self.mfs.readbytes(path)
+            existing = existing if cmd == 'APPE' else existing[:rest]
+        self.mfs.writebytes(path, existing + data)
+        return dropped
 
-    def retrbinary(self, command, callback):
-        cmd, path = command.split(' ')
+    def retrbinary(self, command, callback, blocksize=8192, rest=None):
+        cmd, _, path = command.partition(' ')
         path = self._getpath(path)
-        with self.mfs.openbin(path) as fh:
-            callback(fh.read())
-        return
+        data, dropped = self._drop(self.mfs.readbytes(path)[rest or 0:])
+        callback(data)
+        if dropped:
+            raise EOFError()
+        return '226 Transfer complete'
 
     def pwd(self):
-        return "/".join(self._stack)
+        path = "/".join(self._stack)
+        return '/' + path if self.rooted else path
 
     def nlst(self, dirname=None):
         dirname = dirname or '.'
-        dirname = self._getpath(dirname)
-        return self.mfs.listdir(dirname)
+        self.log.append('NLST {}'.format(dirname))
+        pattern = None
+        if any(c in posixpath.basename(dirname) for c in '*?['):
+            # wildcards are matched like servers that glob NLST arguments
+            dirname, pattern = posixpath.split(dirname)
+        try:
+            names = self.mfs.listdir(self._getpath(dirname or '.'))
+        except FSError as why:
+            raise error_perm('550 {}'.format(why))
+        if pattern is not None:
+            names = fnmatch.filter(names, pattern)
+        return names
 
     def quit(self):
-        self.mfs.close()
+        self.close()
 
     def close(self):
-        self.mfs.close()
+        self.closed = True
 
     def mkd(self, dirname):
+        self.log.append('MKD {}'.format(dirname))
         if dirname:
             dirname = self._getpath(dirname)
-            self.mfs.makedir(dirname)
+            try:
+                self.mfs.makedir(dirname)
+            except DirectoryExists:
+                raise error_perm('550 {} exists'.format(dirname))
 
     def rmd(self, dirname):
-        dirname = self._getpath(dirname)
-        self.mfs.makedir(dirname)
+        self.log.append('RMD {}'.format(dirname))
+        try:
+            self.mfs.removedir(self._getpath(dirname))
+        except FSError as why:
+            raise error_perm('550 {}'.format(why))
 
     def delete(self, filename):
-        filename = self._getpath(filename)
-        self.mfs.remove(filename)
+        self.log.append('DELE {}'.format(filename))
+        try:
+            self.mfs.remove(self._getpath(filename))
+        except FSError as why:
+            raise error_perm('550 {}'.format(why))
 
     def rename(self, fromname, toname):
         fromname = self._getpath(fromname)
         toname = self._getpath(toname)
-        self.mfs.move(fromname, toname)
+        if self.mfs.isdir(fromname):
+            self.mfs.movedir(fromname, toname, create=True)
+        else:
+            self.mfs.move(fromname, toname)
 
     def cwd(self, pathname):
+        self.log.append('CWD {}'.format(pathname))
         if not pathname:
             return
+        if pathname.startswith('/'):
+            self._stack = []
         for dir in pathname.split("/"):
-            if dir == '..' and self._stack:
+            if not dir:
+                continue
+            elif dir == '..' and self._stack:
                 self._stack.pop()
             elif dir not in self.mfs.listdir(stringtype(self.pwd())):
                 raise Exception("{} doesn't exist".format(dir))
@@ -75,9 +208,20 @@ class MockFTP(object):
         return self.mfs.getinfo(filename, namespaces='details').size
 
     def dir(self, dirname, callback):
-        dirname = self._getpath(dirname)
-        for file in self.mfs.scandir(dirname, namespaces=['details', 'access']):
-            line = '{flag}{permissions} 1 {user} {group} {size} {modified} {name}'.format(
+        for line in self._list_lines(dirname):
+            callback(line)
+
+    def _facts(self, info, name):
+        return 'type={};size={};modify={};unique={};unix.mode=0644; {}'.format(
+            'dir' if info.is_dir else 'file',
+            info.size,
+            info.modified.strftime('%Y%m%d%H%M%S'),
+            abs(hash(info.name)),
+            name)
+
+    def _list_lines(self, dirname):
+        for file in self.mfs.scandir(self._getpath(dirname), namespaces=['details', 'access']):
+            yield '{flag}{permissions} 1 {user} {group} {size} {modified} {name}'.format(
                 flag='d' if file.is_dir else '-',
                 size=file.size,
                 name=file.name,
@@ -86,11 +230,139 @@ class MockFTP(object):
                 group='fake_group',
                 permissions='rw-rw-rw-',
             )
-            callback(line)
+
+    def _mlsd_lines(self, dirname):
+        for info in self.mfs.scandir(self._getpath(dirname), namespaces=['details']):
+            yield self._facts(info, info.name)
+
+    def transfercmd(self, command, rest=None):
+        self.transfers += 1
+        if rest is not None:
+            self.sendcmd('REST %s' % rest)
+        cmd, _, arg = command.partition(' ')
+        if cmd in ('LIST', 'MLSD', 'NLST'):
+            lines = {
+                'LIST': self._list_lines,
+                'MLSD': self._mlsd_lines,
+                'NLST': lambda path: self.mfs.listdir(self._getpath(path)),
+            }[cmd](arg or '.')
+            try:
+                data = ''.join(line + '\r\n' for line in lines)
+            except FSError as why:
+                raise error_perm('550 {}'.format(why))
+            return MockSocket(data.encode(self.encoding))
+        offset, self.rest = self.rest, None
+        if cmd == 'RETR':
+            with self.mfs.openbin(self._getpath(arg)) as fh:
+                data, self._dropped = self._drop(fh.read()[offset or 0:])
+            return MockSocket(data)
+        elif cmd in ('STOR', 'APPE'):
+            self.streamed.append(command)
+
+            def on_close(data):
+                self._dropped = self._store(command, data, offset)
+            return MockSocket(on_close=on_close)
+        raise error_perm('502 {} not implemented'.format(cmd))
+
+    def voidresp(self):
+        if self._dropped:
+            self._dropped = False
+            raise EOFError()
+        return '226 Transfer complete'
+
+    def abort(self):
+        self._replies.append('226 ABOR command successful')
+        return '426 Transfer aborted'
+
+    def putcmd(self, line):
+        self._replies.append(self.voidcmd(line))
+
+    def getmultiline(self):
+        return self._replies.pop(0)
+
+    def getresp(self):
+        if not self._replies:
+            raise socket.timeout('timed out')
+        resp = self._replies.pop(0)
+        if resp[:1] in ('1', '2', '3'):
+            return resp
+        if resp[:1] == '4':
+            raise error_temp(resp)
+        if resp[:1] == '5':
+            raise error_perm(resp)
+        raise error_proto(resp)
+
+    def _control(self, line):
+        """ The reply to a command written straight to the control socket """
+        cmd, _, arg = line.partition(' ')
+        try:
+            if cmd == 'DELE':
+                self.delete(arg)
+                return '250 DELE command successful'
+            elif cmd == 'RMD':
+                self.rmd(arg)
+                return '250 RMD command successful'
+            elif cmd == 'MKD':
+                self.mkd(arg)
+                return '257 "{}" created'.format(arg)
+            elif cmd == 'RNFR':
+                if not self.mfs.exists(self._getpath(arg)):
+                    return '550 {} not found'.format(arg)
+                self._rename_from = arg
+                return '350 Ready for RNTO'
+            elif cmd == 'RNTO':
+                if self._rename_from is None:
+                    return '503 Bad sequence of commands'
+                fromname, self._rename_from = self._rename_from, None
+                self.rename(fromname, arg)
+                return '250 Rename successful'
+            elif cmd == 'SIZE':
+                return '213 {}'.format(self.size(arg))
+            elif cmd == 'MDTM':
+                info = self.mfs.getinfo(self._getpath(arg), namespaces=['details'])
+                return '213 {}'.format(info.modified.strftime('%Y%m%d%H%M%S'))
+            return self.voidcmd(line)
+        except error_perm as why:
+            return str(why)
+        except FSError as why:
+            return '550 {}'.format(why)
 
     def sendcmd(self, command):
+        cmd, _, arg = command.partition(' ')
+        if cmd == 'REST':
+            if not self.rest_supported:
+                raise error_perm('502 REST not implemented')
+            self.rest = int(arg)
+            return '350 Restarting at {}'.format(arg)
+        elif cmd == 'MLST':
+            path = self._getpath(arg)
+            if not self.mfs.exists(path):
+                raise error_perm('550 {} not found'.format(arg))
+            info = self.mfs.getinfo(path, namespaces=['details'])
+            return '250-Listing {}\n {}\n250 End'.format(arg, self._facts(info, path))
+        elif cmd == 'FEAT':
+            if not self.features:
+                raise error_perm('502 FEAT not implemented')
+            lines = [' {}'.format(feature) for feature in self.features]
+            return '\n'.join(['211-Features:'] + lines + ['211 End'])
+        elif cmd in ('HASH', 'XMD5', 'XSHA256', 'XCRC'):
+            with self.mfs.openbin(self._getpath(arg)) as fh:
+                data = fh.read()
+            if cmd == 'XCRC':
+                return '250 {:X}'.format(zlib.crc32(data) & 0xffffffff)
+            elif cmd == 'XMD5':
+                return '250 {}'.format(hashlib.md5(data).hexdigest())
+            digest = hashlib.sha256(data).hexdigest()
+            if cmd == 'XSHA256':
+                return '250 {}'.format(digest)
+            return '213 SHA-256 0-{} {} {}'.format(len(data), digest, arg)
         return command
 
+    def voidcmd(self, command):
+        if self.closed:
+            raise EOFError()
+        return '200 {} command successful'.format(command)
+
     def set_pasv(self, passive):
         return passive
 
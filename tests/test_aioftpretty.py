@@ -0,0 +1,114 @@
+import asyncio
+from ftplib import error_perm
+import os
+import shutil
+import tempfile
+import unittest
+
+from aioftpretty import AsyncFtpretty
+from .aio_ftp_server import AioFTPServer
+
+
+class AsyncFtprettyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.local = tempfile.mkdtemp()
+        self.loop = asyncio.new_event_loop()
+        self.server = self.run_async(AioFTPServer(self.root).start())
+        self.pretty = self.run_async(self.session().connect())
+
+    def tearDown(self):
+        self.run_async(self.pretty.close())
+        self.run_async(self.server.stop())
+        self.loop.close()
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.local)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 10))
+
+    def session(self):
+        return AsyncFtpretty('127.0.0.1', 'user', 'pass', port=self.server.port, timeout=5)
+
+    def test_put_get(self):
+        size = self.run_async(self.pretty.put(None, 'photos/a.txt', b'blah'))
+        self.assertEqual(size, 4)
+        self.assertEqual(self.run_async(self.pretty.get('photos/a.txt')), b'blah')
+
+        local_path = os.path.join(self.local, 'b.txt')
+        with open(local_path, 'wb') as f:
+            f.write(b'0123456789' * 10000)
+        self.run_async(self.pretty.put(local_path, 'photos/'))
+        copy_path = os.path.join(self.local, 'copy.txt')
+        self.run_async(self.pretty.get('photos/b.txt', copy_path))
+        with open(copy_path, 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789' * 10000)
+
+    def test_get_missing(self):
+        self.assertRaises(error_perm, self.run_async, self.pretty.get('missing.txt'))
+        self.assertEqual(self.run_async(self.pretty.pwd()), '/')
+
+    def test_list(self):
+        self.run_async(self.pretty.put(None, 'photos/a.txt', b'blah'))
+        self.run_async(self.pretty.mkdir('photos/nature'))
+        self.assertEqual(self.run_async(self.pretty.list('photos')), ['a.txt', 'nature'])
+        entries = self.run_async(self.pretty.list('photos', extra=True))
+        self.assertEqual([(e.name, e.flags, e.size) for e in entries],
+                         [('a.txt', '-', 4), ('nature', 'd', entries[1].size)])
+
+    def test_rename_delete(self):
+        self.run_async(self.pretty.put(None, 'a.txt', b'blah'))
+        self.run_async(self.pretty.rename('a.txt', 'b.txt'))
+        self.assertEqual(self.run_async(self.pretty.list()), ['b.txt'])
+        self.assertTrue(self.run_async(self.pretty.delete('b.txt')))
+        self.run_async(self.pretty.mkdir('empty'))
+        self.assertTrue(self.run_async(self.pretty.delete('empty')))
+        self.assertFalse(self.run_async(self.pretty.delete('empty')))
+        self.assertEqual(self.run_async(self.pretty.list()), [])
+
+    def test_concurrent_sessions(self):
+        async def transfer(i):
+            async with self.session() as pretty:
+                await pretty.put(None, 'file%d.txt' % i, b'%d' % i)
+                return await pretty.get('file%d.txt' % i)
+
+        async def transfers():
+            return await asyncio.gather(*[transfer(i) for i in range(20)])
+
+        results = self.run_async(transfers())
+        self.assertEqual(results, [b'%d' % i for i in range(20)])
+
+    def test_trees(self):
+        tree = os.path.join(self.local, 'tree')
+        os.makedirs(os.path.join(tree, 'bar', 'baz'))
+        for i in range(10):
+            with open(os.path.join(tree, 'bar', 'baz', '%d.txt' % i), 'wb') as f:
+                f.write(b'x' * i)
+        with open(os.path.join(tree, 'foo.txt'), 'wb') as f:
+            f.write(b'message')
+        errors = self.run_async(self.pretty.upload_tree(tree, 'remote/tree', workers=3))
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.sessions, 3)
+
+        copy = os.path.join(self.local, 'copy')
+        errors = self.run_async(self.pretty.get_tree('remote/tree', copy, workers=3))
+        self.assertEqual(errors, [])
+        with open(os.path.join(copy, 'foo.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'message')
+        self.assertEqual(len(os.listdir(os.path.join(copy, 'bar', 'baz'))), 10)
+
+        shutil.rmtree(os.path.join(copy, 'bar'))
+        with open(os.path.join(copy, 'bar'), 'wb') as f:
+            f.write(b'in the way')
+        errors = self.run_async(self.pretty.get_tree('remote/tree', copy))
+        self.assertEqual([error[:2] for error in errors],
+                         [('remote/tree/bar', os.path.join(copy, 'bar'))])
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(AsyncFtprettyTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,19 @@
 import os
 import io
+import json
+import time
 import unittest
 from libfaketime import fake_time, reexec_if_needed
 import shutil
+import socket
 from datetime import datetime
-from ftpretty import ftpretty, split_file_info
+from ftplib import error_perm, error_temp
+from dateutil.tz import tzutc
+from fs.memoryfs import MemoryFS
+import ftpretty as ftpretty_module
+from ftpretty import (ftpretty, FileEntry, FtprettyPool, ListingCache,
+                      TransferManifest, VerificationError, split_file_info,
+                      split_mlsd_info)
 from compat import PY2
 from .mock_ftp import MockFTP
 
@@ -61,6 +70,16 @@ class FtprettyTestCase(unittest.TestCase):
         self.pretty.put(None, 'b.txt', file_contents)
         self.assertEqual(len(self.pretty.list()), 2)
 
+    def test_iter_list(self):
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.pretty.put(None, 'photos/' + name, b'blah')
+        entries = self.pretty.iter_list('photos')
+        self.assertEqual(next(entries).name, 'a.txt')
+        entries.close()
+        self.assertEqual([e.name for e in self.pretty.iter_list('photos')],
+                         ['a.txt', 'b.txt', 'c.txt'])
+        self.assertEqual([e.size for e in self.pretty.iter_list('photos', mlsd=True)], [4, 4, 4])
+
     def test_list_relative_paths(self):
         file_contents = 'blah' if PY2 else b'blah'
         self.pretty.put(None, 'a.txt', file_contents)
@@ -83,6 +102,83 @@ class FtprettyTestCase(unittest.TestCase):
         size = self.pretty.put(None, 'AUTHORS.rst', put_contents)
         self.assertEqual(size, len(put_contents))
 
+    def test_put_known_dirs(self):
+        self.pretty.put(None, 'photos/nature/a.txt', b'a')
+        self.mock_ftp.log = []
+        self.pretty.put(None, 'photos/nature/b.txt', b'b')
+        self.assertEqual(self.mock_ftp.log, ['CWD photos/nature', 'CWD ../..'])
+        self.assertEqual(self.pretty.pwd(), '')
+        self.assertEqual(self.pretty.list('photos/nature'), ['a.txt', 'b.txt'])
+
+    def test_put_direct(self):
+        self.pretty.put(None, 'photos/nature/a.txt', b'a', direct=True)
+        self.assertEqual(self.mock_ftp.log, ['MKD photos', 'MKD photos/nature'])
+        self.mock_ftp.log = []
+        self.pretty.put(None, 'photos/nature/b.txt', b'b', direct=True)
+        self.pretty.put(None, 'photos/c.txt', b'c', direct=True)
+        self.assertEqual(self.mock_ftp.log, [])
+        self.assertEqual(self.pretty.list('photos/nature'), ['a.txt', 'b.txt'])
+
+    def test_known_dirs_invalidation(self):
+        self.pretty.mkdir('photos')
+        self.assertEqual(self.pretty.known_dirs, set(['photos']))
+        self.pretty.rename('photos', 'pictures')
+        self.assertEqual(self.pretty.known_dirs, set())
+        self.pretty.makedirs('/pictures/nature')
+        self.pretty.makedirs('nature')
+        self.pretty.cd('pictures')
+        self.assertEqual(self.pretty.known_dirs, set(['/pictures', '/pictures/nature']))
+
+    def test_put_verify_none(self):
+        self.mock_ftp.size = None
+        size = self.pretty.put(None, 'a.txt', b'blah', verify=None)
+        self.assertEqual(size, 4)
+
+    def test_put_verify_hash(self):
+        for feature in ('HASH SHA-256*;MD5', 'XMD5', 'XCRC', 'XSHA256'):
+            self.mock_ftp.features = [feature]
+            self.pretty._features = None
+            self.assertEqual(self.pretty.put(None, 'a.txt', b'blah', verify='hash'), 4)
+            self.mock_ftp.corrupt = True
+            self.assertRaises(VerificationError, self.pretty.put,
+                              None, 'a.txt', b'blah', verify='hash')
+            self.mock_ftp.corrupt = False
+
+    def test_put_verify_hash_falls_back_to_size(self):
+        self.assertEqual(self.pretty.put(None, 'a.txt', b'blah', verify='hash'), 4)
+        self.mock_ftp.corrupt = True
+        self.assertRaises(VerificationError, self.pretty.put,
+                          None, 'a.txt', b'blah', verify='hash')
+
+    def test_put_verify_unknown(self):
+        for verify in (True, 'md5'):
+            self.assertRaises(ValueError, self.pretty.put, None, 'a.txt', b'blah', verify=verify)
+            self.assertRaises(ValueError, self.pretty.upload_tree, '.', 'tree', verify=verify)
+        self.assertFalse(self.mock_ftp.mfs.exists('a.txt'))
+
+    def test_put_iterable(self):
+        def export():
+            yield b'id,name\n'
+            for i in range(3):
+                yield ('%d,row%d\n' % (i, i)).encode('ascii')
+        size = self.pretty.put(export(), 'export.csv', verify=None)
+        self.assertEqual(size, 29)
+        self.assertEqual(self.pretty.get('export.csv'), b'id,name\n0,row0\n1,row1\n2,row2\n')
+        self.pretty.put(None, 'chunks.csv', contents=[b'ab', b'', b'cd'])
+        self.assertEqual(self.pretty.get('chunks.csv'), b'abcd')
+
+    def test_put_readable(self):
+        class Source(object):
+            def __init__(self):
+                self.data = io.BytesIO(b'streamed')
+            def read(self, size=-1):
+                return self.data.read(size)
+            def close(self):
+                pass
+        self.assertEqual(self.pretty.put(Source(), 'stream.txt', verify=None), 8)
+        self.assertEqual(self.pretty.put(None, 'stream2.txt', contents=Source()), 8)
+        self.assertEqual(self.pretty.get('stream2.txt'), b'streamed')
+
     def test_upload_tree(self):
         os.mkdir("testdata")
         os.mkdir("testdata/tree")
@@ -127,6 +223,174 @@ class FtprettyTestCase(unittest.TestCase):
         shutil.rmtree("testdata")
 
 
+    def test_walk(self):
+        self.createFixtures()
+        self.pretty.put(None, 'photos/nature/lake.log', b'lake')
+        self.pretty.put(None, 'photos/a.txt', b'a')
+        self.assertEqual(list(self.pretty.walk('photos')), [
+            ('photos', ['nature'], ['a.txt']),
+            ('photos/nature', ['mountains'], ['lake.log']),
+            ('photos/nature/mountains', [], []),
+        ])
+
+        walked = []
+        for dirpath, dirs, files in self.pretty.walk('.', extra=True):
+            walked.append(dirpath)
+            self.assertTrue(all(isinstance(entry, FileEntry) for entry in dirs + files))
+            dirs[:] = [entry for entry in dirs if entry.name != 'nature']
+        self.assertEqual(walked, ['.', './photos'])
+
+        errors = []
+        self.assertEqual(list(self.pretty.walk('missing', onerror=errors.append)), [])
+        self.assertEqual(len(errors), 1)
+
+    def test_get_stream(self):
+        self.pretty.put(None, 'remote_file.txt', b'0123456789')
+        with self.pretty.get_stream('remote_file.txt', chunk_size=4) as stream:
+            self.assertEqual(list(stream), [b'0123', b'4567', b'89'])
+            self.assertTrue(stream.closed)
+        with self.pretty.get_stream('remote_file.txt') as stream:
+            buf = bytearray(3)
+            self.assertEqual(stream.readinto(buf), 3)
+            self.assertEqual(bytes(buf), b'012')
+            self.assertEqual(stream.read(), b'3456789')
+        with self.pretty.get_stream('remote_file.txt') as stream:
+            self.assertEqual(stream.read(0), b'')
+            self.assertEqual(stream.readinto(bytearray()), 0)
+            self.assertFalse(stream.closed)
+            self.assertEqual(stream.read(), b'0123456789')
+        stream = self.pretty.get_stream('remote_file.txt')
+        self.assertEqual(stream.read(2), b'01')
+        stream.close()
+        self.assertEqual(stream.read(), b'')
+
+    def test_get_resume(self):
+        self.pretty.put(None, 'remote_file.txt', b'0123456789')
+        with open('local_copy.txt', 'wb') as f:
+            f.write(b'0123')
+        try:
+            self.pretty.get('remote_file.txt', 'local_copy.txt', resume=True)
+            with open('local_copy.txt', 'rb') as f:
+                self.assertEqual(f.read(), b'0123456789')
+        finally:
+            os.unlink('local_copy.txt')
+
+    def test_get_retries(self):
+        self.pretty.retry_delay = 0
+        self.pretty.put(None, 'remote_file.txt', b'0123456789')
+        self.mock_ftp.drop_transfers = 2
+        self.assertEqual(self.pretty.get('remote_file.txt', retries=2), b'0123456789')
+        self.mock_ftp.drop_transfers = 1
+        self.assertRaises(EOFError, self.pretty.get, 'remote_file.txt')
+
+    def test_put_resume(self):
+        self.pretty.put(None, 'photos/remote_file.txt', b'01234')
+        modes = self._record_size_mode()
+        size = self.pretty.put(None, 'photos/remote_file.txt', b'0123456789', resume=True)
+        self.assertEqual(size, 10)
+        self.assertEqual(set(modes), set(['I']))
+        self.assertEqual(self.pretty.get('photos/remote_file.txt'), b'0123456789')
+
+    def test_put_retries(self):
+        self.pretty.retry_delay = 0
+        self.mock_ftp.features = ['XMD5']
+        self.mock_ftp.drop_transfers = 2
+        size = self.pretty.put(None, 'remote_file.txt', b'0123456789', retries=2, verify='hash')
+        self.assertEqual(size, 10)
+        self.assertEqual(self.pretty.get('remote_file.txt'), b'0123456789')
+
+    def test_get_into_buffer(self):
+        self.pretty.retry_delay = 0
+        self.pretty.put(None, 'remote_file.txt', b'0123456789')
+        buf = bytearray(12)
+        self.mock_ftp.drop_transfers = 1
+        self.assertEqual(self.pretty.get('remote_file.txt', buf, retries=1), 10)
+        self.assertEqual(bytes(buf), b'0123456789\0\0')
+        view = memoryview(bytearray(10))
+        self.assertEqual(self.pretty.get('remote_file.txt', view), 10)
+        self.assertEqual(view.tobytes(), b'0123456789')
+        self.assertRaises(ValueError, self.pretty.get, 'remote_file.txt', bytearray(4))
+        self.assertEqual(self.mock_ftp._replies, [])
+
+    def _record_size_mode(self):
+        """ Record the transfer type each SIZE is sent in """
+        modes, current = [], ['A']
+        voidcmd, size = self.mock_ftp.voidcmd, self.mock_ftp.size
+
+        def record_voidcmd(command):
+            if command.startswith('TYPE '):
+                current[0] = command[5:]
+            return voidcmd(command)
+
+        def record_size(remote):
+            modes.append(current[0])
+            return size(remote)
+        self.mock_ftp.voidcmd, self.mock_ftp.size = record_voidcmd, record_size
+        return modes
+
+    def test_get_mmap(self):
+        self.pretty.put(None, 'remote_file.txt', b'0123456789')
+        self.mock_ftp.mfs.writebytes('empty.txt', b'')
+        try:
+            self.pretty.get('remote_file.txt', 'local_copy.txt', mmap=True)
+            with open('local_copy.txt', 'rb') as f:
+                self.assertEqual(f.read(), b'0123456789')
+            self.pretty.get('empty.txt', 'local_copy.txt', mmap=True)
+            self.assertEqual(os.path.getsize('local_copy.txt'), 0)
+            modes = self._record_size_mode()
+            self.pretty.get('remote_file.txt', 'local_copy.txt', mmap=True)
+            self.assertEqual(modes, ['I'])
+        finally:
+            os.unlink('local_copy.txt')
+
+    def test_blocksize(self):
+        pretty = ftpretty(None, None, None, ftp_conn=self.mock_ftp, blocksize=4)
+        self.assertEqual(pretty.blocksize, 4)
+        for blocksize in (0, 'fast'):
+            self.assertRaises(ValueError, ftpretty, None, None, None,
+                              ftp_conn=self.mock_ftp, blocksize=blocksize)
+            self.assertRaises(ValueError, pretty.get, 'remote_file.txt', blocksize=blocksize)
+        for blocksize in (None, 3, 'auto'):
+            pretty.put(None, 'remote_file.txt', b'0123456789', blocksize=blocksize)
+            self.assertEqual(pretty.get('remote_file.txt', blocksize=blocksize), b'0123456789')
+
+    def test_adaptive_blocksize(self):
+        blocks = ftpretty_module._BlockSize('auto')
+        blocks.sample_time = 100
+        self.assertEqual(blocks.size, 8192)
+        self.assertEqual(blocks.update(1000), 8192)
+        blocks._since -= 100
+        self.assertEqual(blocks.update(1000), 16384)
+        blocks._since -= 100
+        self.assertEqual(blocks.update(4000), 32768)
+        blocks._since -= 100
+        self.assertEqual(blocks.update(10), 32768)
+        blocks._since -= 100
+        self.assertEqual(blocks.update(100000), 32768)
+        self.assertTrue(blocks.settled)
+        self.assertEqual(ftpretty_module._BlockSize(1024).update(1 << 30), 1024)
+
+    def test_put_sendfile(self):
+        self.pretty.retry_delay = 0
+        with open('local_file.txt', 'wb') as f:
+            f.write(b'0123456789')
+        try:
+            self.mock_ftp.drop_transfers = 1
+            size = self.pretty.put('local_file.txt', 'remote_file.txt', retries=1)
+            self.assertEqual(size, 10)
+            self.assertEqual(self.mock_ftp.streamed, ['STOR remote_file.txt'] * 2)
+            self.assertEqual(self.mock_ftp.rest, None)
+            self.assertEqual(self.pretty.get('remote_file.txt'), b'0123456789')
+
+            # hashing reads the data in python, as does a buffer in memory
+            self.mock_ftp.features = ['XMD5']
+            self.pretty.put('local_file.txt', 'remote_file.txt', verify='hash')
+            self.pretty.put(None, 'remote_file.txt', b'0123456789')
+            self.assertEqual(self.mock_ftp.stored, ['STOR remote_file.txt'] * 2)
+            self.assertEqual(len(self.mock_ftp.streamed), 2)
+        finally:
+            os.unlink('local_file.txt')
+
     def test_get_filehandle(self):
         file_contents = 'hello_file' if PY2 else b'hello_file'
         self.pretty.put(None, 'remote_file.txt', file_contents)
@@ -247,6 +511,81 @@ class FtprettyTestCase(unittest.TestCase):
         self.assertEqual(files[2]['owner'], 'rharrigan')
         self.assertEqual(files[2]['group'], 'dodgy-group-name')
 
+    def test_list_mlsd(self):
+        self.mock_ftp.features = ['MLST type*;size*;modify*;unique*;unix.mode;']
+        self.pretty.put(None, 'photos/a.txt', b'blah')
+        self.mock_ftp.log = []
+        files = self.pretty.list('.', extra=True)
+        self.assertEqual(len(files), 1)
+        self.assertEqual(files[0].name, 'photos')
+        self.assertEqual(files[0].flags, 'd')
+        files = self.pretty.list('photos', extra=True)
+        self.assertEqual(files[0].size, 4)
+        self.assertEqual(files[0].perms, 'rw-r--r--')
+        self.assertEqual(len(self.pretty.list('photos', extra=True, mlsd=False)), 1)
+
+    def test_dir_parse_reference_time(self):
+        fileinfo = [
+            "-rw-rw-r-- 1 rharrigan www   47 Feb 20 11:39 Cool.txt\n",
+            "-rw-rw-r-- 1 rharrigan nobody 2085 Dec 21 13:27 multi word name.png\n",
+            "-rw-rw-r-- 1 rharrigan wheel  195 Feb 29 09:15 leap.txt\n",
+            "-rw-rw-r-- 1 rharrigan wheel  195 Feb 20 2013 README.txt\n"
+        ]
+        files = split_file_info(fileinfo, now=datetime(2021, 2, 22, 12, 1, 1))
+        self.assertEqual(files[0]['datetime'], datetime(2021, 2, 20, 11, 39))
+        self.assertEqual(files[0]['year'], '2021')
+        self.assertEqual(files[1]['datetime'], datetime(2020, 12, 21, 13, 27))
+        self.assertEqual(files[2]['datetime'], datetime(2020, 2, 29, 9, 15))
+        self.assertEqual(files[3]['datetime'], datetime(2013, 2, 20, 0, 0))
+        self.assertEqual(files[3]['time'], '00:00')
+
+    def test_file_entry(self):
+        entry = split_file_info(["drwxr-xr-t 2 rharrigan wheel 4096 Jan 31  2019 dist\n"])[0]
+        self.assertIsInstance(entry, FileEntry)
+        self.assertEqual(entry.name, 'dist')
+        self.assertEqual(entry['name'], 'dist')
+        self.assertEqual(entry['items'], '2')
+        self.assertEqual(entry.directory, 'd')
+        self.assertEqual(entry.get('missing', 1), 1)
+        self.assertRaises(KeyError, entry.__getitem__, 'missing')
+        self.assertIsNone(entry._datetime)
+        self.assertEqual(entry.datetime, datetime(2019, 1, 31))
+        self.assertEqual(dict(entry.items())['size'], 4096)
+        self.assertEqual(entry, entry.asdict())
+        self.assertFalse(hasattr(entry, '__dict__'))
+        self.assertIsNone(entry.missing)
+        self.assertEqual(json.loads(json.dumps(entry.asdict(), default=str))['name'], 'dist')
+
+    def test_mlsd_parse(self):
+        files = split_mlsd_info([
+            "type=cdir;modify=20210101000000; .",
+            "type=pdir;modify=20210101000000; ..",
+            "type=file;size=47;modify=20210220113905.123;unique=801U2;UNIX.mode=0640;"
+            "UNIX.owner=rob.harrigan;UNIX.group=www data; Cool file.txt",
+            "type=dir;sizd=4096;modify=19991231235959;perm=flcdmpe; dist",
+        ])
+        self.assertEqual(len(files), 2)
+        self.assertEqual(files[0]['name'], 'Cool file.txt')
+        self.assertEqual(files[0]['datetime'], datetime(2021, 2, 20, 11, 39, 5, 123000, tzutc()))
+        self.assertEqual(files[0]['size'], 47)
+        self.assertEqual(files[0]['perms'], 'rw-r-----')
+        self.assertEqual(files[0]['owner'], 'rob.harrigan')
+        self.assertEqual(files[0]['group'], 'www data')
+        self.assertEqual(files[0]['unique'], '801U2')
+        self.assertEqual(files[1]['flags'], 'd')
+        self.assertEqual(files[1]['year'], '1999')
+
+    def test_stat(self):
+        self.pretty.put(None, 'photos/a.txt', b'blah')
+        self.assertEqual(self.pretty.stat('photos/a.txt').size, 4)
+        self.assertIsNone(self.pretty.stat('photos/b.txt'))
+        self.mock_ftp.features = ['MLST type*;size*;modify*;']
+        self.pretty._features = None
+        self.assertEqual(self.pretty.stat('photos/a.txt').size, 4)
+        self.assertEqual(self.pretty.stat('photos/a.txt').name, 'a.txt')
+        self.assertEqual(self.pretty.stat('photos').flags, 'd')
+        self.assertIsNone(self.pretty.stat('photos/b.txt'))
+
     def test_fallthrough(self):
         self.assertTrue(self.pretty.sendcmd('hello'), 'hello')
 
@@ -256,14 +595,602 @@ class FtprettyTestCase(unittest.TestCase):
     def test_custom_port(self):
         ftpretty(None, None, None, ftp_conn=self.mock_ftp, port=2121)
 
+    def test_port_passed_to_connect(self):
+        calls = []
+
+        class RecordingFTP(object):
+            port = 21
+
+            def __init__(self, **kwargs):
+                calls.append(('init', kwargs))
+
+            def connect(self, host, port):
+                calls.append(('connect', host, port))
+
+            def login(self, user, password, acct):
+                calls.append(('login', user, password, acct))
+
+        original, ftpretty_module.FTP = ftpretty_module.FTP, RecordingFTP
+        try:
+            ftpretty('host', 'user', 'pass', port=2121, timeout=10)
+            ftpretty('host', 'user', 'pass', acct='billing')
+        finally:
+            ftpretty_module.FTP = original
+        self.assertEqual(calls, [('init', {'timeout': 10}),
+                                 ('connect', 'host', 2121),
+                                 ('login', 'user', 'pass', ''),
+                                 ('init', {'acct': 'billing'}),
+                                 ('connect', 'host', 0),
+                                 ('login', 'user', 'pass', 'billing')])
+        self.assertEqual(RecordingFTP.port, 21)
+
     def test_close(self):
         self.pretty.close()
 
 
+class FtprettyPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.mfs = MemoryFS()
+        self.mfs.makedir('photos')
+        self.created = []
+        self.pool = FtprettyPool(None, None, None, size=2, factory=self.factory)
+
+    def factory(self):
+        pretty = ftpretty(None, None, None, ftp_conn=MockFTP(self.mfs, rooted=True))
+        self.created.append(pretty)
+        return pretty
+
+    def test_reuse(self):
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(len(self.created), 1)
+
+    def test_bounded(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertIsNot(first, second)
+        self.assertRaises(RuntimeError, self.pool.acquire, 0.01)
+        self.pool.release(first)
+        self.assertIs(self.pool.acquire(0.01), first)
+
+    def test_reset_cwd(self):
+        with self.pool.connection() as pretty:
+            pretty.cd('photos')
+            self.assertEqual(pretty.pwd(), '/photos')
+        with self.pool.connection() as pretty:
+            self.assertEqual(pretty.pwd(), '/')
+
+    def test_idle_eviction(self):
+        self.pool.max_idle = 0
+        with self.pool.connection():
+            pass
+        self.assertEqual(self.pool.evict(), 1)
+        self.assertTrue(self.created[0].conn.closed)
+
+    def test_max_lifetime(self):
+        self.pool.max_lifetime = 0
+        with self.pool.connection():
+            pass
+        with self.pool.connection():
+            pass
+        self.assertEqual(len(self.created), 2)
+        self.assertTrue(self.created[0].conn.closed)
+
+    def test_health_check(self):
+        self.pool.check_after = 0
+        with self.pool.connection() as pretty:
+            pass
+        pretty.conn.closed = True
+        with self.pool.connection() as pretty:
+            self.assertIs(pretty, self.created[1])
+
+    def test_discard_on_connection_error(self):
+        with self.assertRaises(EOFError):
+            with self.pool.connection():
+                raise EOFError()
+        self.assertTrue(self.created[0].conn.closed)
+        with self.pool.connection():
+            pass
+        self.assertEqual(len(self.created), 2)
+
+    def test_parallel_get_tree(self):
+        pretty = self.factory()
+        pretty.put(None, 'photos/nature/mountains/travel.log', b'blah')
+        pretty.put(None, 'photos/nature/lake.log', b'lake')
+        pretty.put(None, 'photos/a.txt', b'a')
+        os.mkdir('testdata')
+        os.makedirs('testdata/photos/a.txt')
+        try:
+            errors = pretty.get_tree('photos', 'testdata/photos', workers=2, pool=self.pool)
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(errors[0][:2], ('/photos/a.txt', 'testdata/photos/a.txt'))
+            self.assertEqual(4, os.path.getsize('testdata/photos/nature/mountains/travel.log'))
+            self.assertEqual(4, os.path.getsize('testdata/photos/nature/lake.log'))
+        finally:
+            shutil.rmtree('testdata')
+
+    def test_parallel_get_tree_from_pooled_connection(self):
+        for workers in (2, 4):
+            with self.pool.connection() as pretty:
+                for i in range(50):
+                    pretty.put(None, 'photos/%d.txt' % i, b'data')
+                os.makedirs('testdata')
+                try:
+                    errors = pretty.get_tree('photos', 'testdata', workers=workers, pool=self.pool)
+                    self.assertEqual(errors, [])
+                    self.assertEqual(len(os.listdir('testdata')), 50)
+                finally:
+                    shutil.rmtree('testdata')
+            with self.pool.connection(), self.pool.connection() as pretty:
+                os.makedirs('testdata')
+                try:
+                    errors = pretty.get_tree('photos', 'testdata', workers=workers, pool=self.pool)
+                    self.assertEqual(errors, [])
+                    self.assertEqual(len(os.listdir('testdata')), 50)
+                finally:
+                    shutil.rmtree('testdata')
+
+    def test_parallel_upload_tree(self):
+        pretty = self.factory()
+        os.makedirs('testdata/tree/bar/baz')
+        with open('testdata/tree/foo.txt', 'w') as f:
+            f.write('message')
+        with open('testdata/tree/bar/baz/qux.txt', 'w') as f:
+            f.write('another message')
+        with open('testdata/tree/bar/clash.txt', 'w') as f:
+            f.write('clash')
+        self.mfs.makedirs('tree/bar/clash.txt')
+        try:
+            errors = pretty.upload_tree('testdata/tree', 'tree', workers=2, pool=self.pool)
+        finally:
+            shutil.rmtree('testdata')
+        self.assertEqual([e[:2] for e in errors],
+                         [('testdata/tree/bar/clash.txt', '/tree/bar/clash.txt')])
+        self.assertEqual(b'message', pretty.get('tree/foo.txt'))
+        self.assertEqual(b'another message', pretty.get('tree/bar/baz/qux.txt'))
+
+    def test_segmented_get(self):
+        pretty = self.factory()
+        pretty.min_segment_size = 4
+        pretty.put(None, 'photos/big.bin', b'0123456789abcdef!')
+        try:
+            pretty.get('photos/big.bin', 'local_copy.bin', segments=3, pool=self.pool)
+            with open('local_copy.bin', 'rb') as f:
+                self.assertEqual(f.read(), b'0123456789abcdef!')
+            self.assertEqual(len(self.created), 3)
+            for conn in self.created:
+                self.assertEqual(conn.conn._replies, [])
+            self.assertIsNone(pretty.conn.rest)
+        finally:
+            os.unlink('local_copy.bin')
+
+    def test_segmented_get_fallback(self):
+        def factory():
+            pretty = self.factory()
+            pretty.conn.rest_supported = False
+            return pretty
+        pool = FtprettyPool(None, None, None, size=2, factory=factory)
+        pretty = self.factory()
+        pretty.min_segment_size = 4
+        pretty.put(None, 'photos/big.bin', b'0123456789abcdef!')
+        try:
+            pretty.get('photos/big.bin', 'local_copy.bin', segments=3, pool=pool)
+            with open('local_copy.bin', 'rb') as f:
+                self.assertEqual(f.read(), b'0123456789abcdef!')
+            # without a pool an ftp_conn session can only use its own connection
+            pretty.conn.transfers = 0
+            pretty.get('photos/big.bin', 'local_copy.bin', segments=3)
+            with open('local_copy.bin', 'rb') as f:
+                self.assertEqual(f.read(), b'0123456789abcdef!')
+            self.assertEqual(pretty.conn.transfers, 1)
+        finally:
+            os.unlink('local_copy.bin')
+
+    def test_sync_down(self):
+        pretty = self.factory()
+        pretty.conn.features = ['MLST']
+        pretty.put(None, 'photos/nature/lake.log', b'lake')
+        pretty.put(None, 'photos/a.txt', b'a')
+        try:
+            result = pretty.sync_down('photos', 'testdata')
+            self.assertEqual(result.errors, [])
+            self.assertEqual([action for action, _, _ in result.plan], ['mkdir', 'mkdir', 'get', 'get'])
+            self.assertEqual(pretty.sync_down('photos', 'testdata').plan, [])
+
+            pretty.put(None, 'photos/a.txt', b'changed')
+            with open('testdata/extra.txt', 'w') as f:
+                f.write('extra')
+            os.makedirs('testdata/old/deeper')
+            result = pretty.sync_down('photos', 'testdata', delete=True, dry_run=True)
+            self.assertEqual(result.plan, [
+                ('get', '/photos/a.txt', os.path.join('testdata', 'a.txt')),
+                ('delete', '/photos/extra.txt', os.path.join('testdata', 'extra.txt')),
+                ('rmdir', '/photos/old', os.path.join('testdata', 'old')),
+            ])
+            self.assertTrue(os.path.exists('testdata/extra.txt'))
+            result = pretty.sync_down('photos', 'testdata', delete=True)
+            self.assertEqual(result.errors, [])
+            self.assertEqual(sorted(os.listdir('testdata')), ['a.txt', 'nature'])
+            with open('testdata/a.txt', 'rb') as f:
+                self.assertEqual(f.read(), b'changed')
+        finally:
+            shutil.rmtree('testdata')
+
+    def test_sync_up(self):
+        pretty = self.factory()
+        pretty.conn.features = ['MLST']
+        os.makedirs('testdata/bar')
+        with open('testdata/foo.txt', 'w') as f:
+            f.write('message')
+        with open('testdata/bar/baz.txt', 'w') as f:
+            f.write('another message')
+        try:
+            result = pretty.sync_up('testdata', 'tree', workers=2, pool=self.pool)
+            self.assertEqual(result.errors, [])
+            self.assertEqual([action for action, _, _ in result.plan], ['mkdir', 'mkdir', 'put', 'put'])
+            self.assertEqual(b'another message', pretty.get('tree/bar/baz.txt'))
+            self.assertEqual(pretty.sync_up('testdata', 'tree').plan, [])
+
+            with open('testdata/foo.txt', 'w') as f:
+                f.write('a longer message')
+            pretty.put(None, 'tree/extra/stale.txt', b'stale')
+            pretty.put(None, 'tree/extra/sub/deeper.txt', b'deeper')
+            pretty.put(None, 'tree/old.txt', b'old')
+            result = pretty.sync_up('testdata', 'tree', delete=True)
+            self.assertEqual(result.errors, [])
+            # RMD needs empty directories, so every one is removed, deepest first
+            self.assertEqual(result.plan, [
+                ('put', '/tree/foo.txt', os.path.join('testdata', 'foo.txt')),
+                ('delete', '/tree/extra/stale.txt', os.path.join('testdata', 'extra', 'stale.txt')),
+                ('delete', '/tree/extra/sub/deeper.txt',
+                 os.path.join('testdata', 'extra', 'sub', 'deeper.txt')),
+                ('delete', '/tree/old.txt', os.path.join('testdata', 'old.txt')),
+                ('rmdir', '/tree/extra/sub', os.path.join('testdata', 'extra', 'sub')),
+                ('rmdir', '/tree/extra', os.path.join('testdata', 'extra')),
+            ])
+            self.assertEqual(sorted(self.mfs.listdir('tree')), ['bar', 'foo.txt'])
+            self.assertEqual(b'a longer message', pretty.get('tree/foo.txt'))
+        finally:
+            shutil.rmtree('testdata')
+
+    def test_manifest_put(self):
+        pretty = self.factory()
+        pretty.manifest = TransferManifest(':memory:')
+        os.makedirs('testdata/tree/bar')
+        with open('testdata/tree/foo.txt', 'w') as f:
+            f.write('message')
+        with open('testdata/tree/bar/baz.txt', 'w') as f:
+            f.write('another message')
+        try:
+            self.assertEqual(pretty.put('testdata/tree/foo.txt', 'photos/'), 7)
+            pretty.conn.transfers = 0
+            self.assertEqual(pretty.put('testdata/tree/foo.txt', 'photos/foo.txt'), 7)
+            # a new mtime alone is settled by the content hash
+            os.utime('testdata/tree/foo.txt', (0, 0))
+            self.assertEqual(pretty.put('testdata/tree/foo.txt', 'photos/foo.txt'), 7)
+            self.assertEqual(pretty.conn.transfers, 0)
+            with open('testdata/tree/foo.txt', 'w') as f:
+                f.write('changed message')
+            pretty.put('testdata/tree/foo.txt', 'photos/foo.txt')
+            self.assertEqual(pretty.conn.transfers, 1)
+
+            errors = pretty.upload_tree('testdata/tree', 'tree', workers=2, pool=self.pool)
+            self.assertEqual(errors, [])
+            self.assertEqual(b'another message', pretty.get('tree/bar/baz.txt'))
+            pretty.conn.transfers = 0
+            for conn in self.created:
+                conn.conn.transfers = 0
+            pretty.upload_tree('testdata/tree', 'tree')
+            self.assertEqual(sum(conn.conn.transfers for conn in self.created), 0)
+        finally:
+            shutil.rmtree('testdata')
+
+    def test_manifest_get_tree(self):
+        path = os.path.abspath('manifest.db')
+        pretty = self.factory()
+        pretty.put(None, 'photos/nature/lake.log', b'lake')
+        pretty.put(None, 'photos/a.txt', b'a')
+        os.mkdir('testdata')
+        try:
+            with TransferManifest(path) as manifest:
+                pretty.manifest = manifest
+                pretty.get_tree('photos', 'testdata')
+            self.assertEqual(4, os.path.getsize('testdata/nature/lake.log'))
+
+            # a later run neither lists nor downloads
+            with TransferManifest(path) as manifest:
+                pretty.manifest = manifest
+                pretty.conn.transfers = 0
+                pretty.get_tree('photos', 'testdata')
+                self.assertEqual(pretty.conn.transfers, 0)
+
+                self.mfs.writebytes('photos/a.txt', b'abc')
+                manifest.mark_stale('/photos')
+                errors = pretty.get_tree('photos', 'testdata', workers=2, pool=self.pool)
+                self.assertEqual(errors, [])
+                self.assertEqual(sum(conn.conn.transfers for conn in self.created), 3)
+                with open('testdata/a.txt', 'rb') as f:
+                    self.assertEqual(f.read(), b'abc')
+
+                pretty.delete('photos/a.txt')
+                self.assertEqual([e.name for e in manifest.listing('/photos')], ['nature'])
+        finally:
+            shutil.rmtree('testdata')
+            os.unlink(path)
+
+    def test_listing_cache(self):
+        cache = ListingCache(ttl=None, size=3)
+        pretty = self.factory()
+        pretty.cache = cache
+        pretty.put(None, 'photos/a.txt', b'a')
+        pretty.conn.transfers = 0
+        self.assertEqual(pretty.list('/photos'), ['a.txt'])
+        self.assertEqual(pretty.list('/photos'), ['a.txt'])
+        self.assertEqual([e.name for e in pretty.list('/photos', extra=True)], ['a.txt'])
+        self.assertEqual(pretty.stat('/photos/a.txt').size, 1)
+        self.assertEqual(pretty.stat('/photos/a.txt').size, 1)
+        # without MLST stat() lists the parent, which is cached as well
+        self.assertEqual(pretty.conn.transfers, 1)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+
+        # writes drop the entries of the path and its parent
+        pretty.put(None, 'photos/b.txt', b'bb')
+        self.assertEqual(pretty.list('/photos'), ['a.txt', 'b.txt'])
+        pretty.rename('photos/b.txt', 'photos/c.txt')
+        self.assertEqual(pretty.list('/photos'), ['a.txt', 'c.txt'])
+        pretty.delete('/photos/a.txt')
+        self.assertIsNone(pretty.stat('/photos/a.txt'))
+        pretty.mkdir('/photos/nature')
+        self.assertEqual(pretty.list('/photos'), ['c.txt', 'nature'])
+
+        # least recently used results are evicted
+        for name in ('x', 'y', 'z'):
+            pretty.makedirs('/%s' % name)
+            pretty.list('/%s' % name)
+        self.assertEqual(len(cache), 3)
+        misses = cache.misses
+        pretty.list('/photos')
+        self.assertEqual(cache.misses, misses + 1)
+
+        cache.ttl = 0
+        pretty.list('/x')
+        self.assertEqual(cache.misses, misses + 2)
+
+    def test_pool_listing_cache(self):
+        cache = ListingCache()
+        pool = FtprettyPool(None, None, None, size=2, factory=lambda: self.factory())
+        with pool.connection() as pretty:
+            pretty.cache = cache
+            self.assertEqual(pretty.list('/photos'), [])
+        os.makedirs('testdata/tree')
+        with open('testdata/tree/foo.txt', 'w') as f:
+            f.write('message')
+        try:
+            with pool.connection() as pretty:
+                pretty.cache = cache
+                self.assertEqual(pretty.list('/photos'), [])
+                pretty.upload_tree('testdata/tree', '/photos/tree', workers=2, pool=self.pool)
+                self.assertEqual(pretty.list('/photos'), ['tree'])
+                self.assertEqual(pretty.list('/photos/tree'), ['foo.txt'])
+        finally:
+            shutil.rmtree('testdata')
+        self.assertEqual(cache.hits, 1)
+
+    def test_sync_up_invalidates_listing_cache(self):
+        pretty = self.factory()
+        pretty.cache = ListingCache()
+        pretty.put(None, 'tree/a.txt', b'a')
+        self.assertEqual(pretty.list('/tree'), ['a.txt'])
+        os.makedirs('testdata')
+        for name in ('a.txt', 'b.txt'):
+            with open(os.path.join('testdata', name), 'w') as f:
+                f.write(name)
+        try:
+            result = pretty.sync_up('testdata', '/tree', workers=2, pool=self.pool)
+        finally:
+            shutil.rmtree('testdata')
+        self.assertEqual(result.errors, [])
+        self.assertEqual(sorted(pretty.list('/tree')), ['a.txt', 'b.txt'])
+
+    def test_parallel_walk(self):
+        pretty = self.factory()
+        for i in range(20):
+            pretty.put(None, 'photos/%d/%d/file.txt' % (i, i), b'data')
+        walked = {}
+        for dirpath, dirs, files in pretty.walk('photos', workers=2, pool=self.pool):
+            walked[dirpath] = (sorted(dirs), files)
+            # the session itself is free while walking
+            self.assertEqual(pretty.pwd(), '/')
+        self.assertEqual(len(walked), 41)
+        self.assertEqual(walked['photos/3'], (['3'], []))
+        self.assertEqual(walked['photos/3/3'], ([], ['file.txt']))
+
+        # breaking out of the walk returns the connections
+        for dirpath, dirs, files in pretty.walk('/photos', workers=2, pool=self.pool):
+            break
+        self.assertEqual(dirpath, '/photos')
+        with self.pool.connection(0.1), self.pool.connection(0.1):
+            pass
+
+    def test_walk_from_pooled_connection(self):
+        pool = FtprettyPool(None, None, None, size=1, factory=self.factory)
+        with pool.connection() as pretty:
+            pretty.put(None, 'photos/nature/lake.log', b'lake')
+            walked = [dirpath for dirpath, _, _ in pretty.walk('photos', workers=2, pool=pool)]
+            self.assertEqual(walked, ['photos', 'photos/nature'])
+            result = pretty.rmtree('photos', workers=2, pool=pool)
+            self.assertEqual(result, (1, 2, []))
+            self.assertEqual(self.mfs.listdir('/'), [])
+
+    def test_find(self):
+        pretty = self.factory()
+        pretty.put(None, 'photos/big.csv', b'x' * 100)
+        pretty.put(None, 'photos/small.csv', b'x')
+        pretty.put(None, 'photos/notes.txt', b'x' * 100)
+        pretty.put(None, 'photos/2020/old.csv', b'x' * 100)
+        pretty.put(None, 'photos/2020/deep/deeper.csv', b'x' * 100)
+        pretty.put(None, 'photos/cache/skip.csv', b'x' * 100)
+
+        found = pretty.find('/photos', name_glob='*.csv', min_size=10, type='f')
+        self.assertEqual(sorted(path for path, entry in found), [
+            '/photos/2020/deep/deeper.csv', '/photos/2020/old.csv',
+            '/photos/big.csv', '/photos/cache/skip.csv'])
+        self.assertEqual(sorted(path for path, _ in pretty.find('/photos', type='d')),
+                         ['/photos/2020', '/photos/2020/deep', '/photos/cache'])
+
+        found = pretty.find('/photos', name_glob='*.csv', maxdepth=2,
+                            prune=lambda path, entry: entry.name == 'cache')
+        self.assertEqual(sorted(path for path, _ in found),
+                         ['/photos/2020/old.csv', '/photos/big.csv', '/photos/small.csv'])
+
+        self.assertEqual(list(pretty.find('/photos', newer_than=time.time() + 3600)), [])
+        self.assertEqual(len(list(pretty.find('/photos', type='f', workers=2, pool=self.pool,
+                                              newer_than=datetime(2000, 1, 1, tzinfo=tzutc())))), 6)
+
+        # without nlst the entries are complete
+        found = list(pretty.find('/photos', name_glob='*.csv', maxdepth=1))
+        self.assertEqual([entry.size for path, entry in sorted(found)], [100, 1])
+
+        # with nlst a lone pattern one level deep is left to the server
+        pretty.conn.log = []
+        found = list(pretty.find('/photos', name_glob='*.csv', maxdepth=1, nlst=True))
+        self.assertEqual(pretty.conn.log, ['NLST /photos/*.csv'])
+        self.assertEqual([path for path, entry in found], ['/photos/big.csv', '/photos/small.csv'])
+        self.assertEqual(list(pretty.find('/photos', name_glob='*.zip', maxdepth=1, nlst=True)), [])
+
+        def no_files(*args):
+            raise error_temp('450 No files found')
+        pretty.conn.nlst = no_files
+        self.assertEqual(list(pretty.find('/photos', name_glob='*.zip', maxdepth=1, nlst=True)), [])
+
+        self.assertRaises(ValueError, pretty.find, '/photos', type='x')
+        self.assertRaises(ValueError, pretty.find, '/photos', name_glob='*.csv', nlst=True)
+
+    def test_rmtree(self):
+        pretty = self.factory()
+        for i in range(10):
+            pretty.put(None, 'photos/%d/%d/file.txt' % (i, i), b'data')
+            pretty.put(None, 'photos/%d/other.txt' % i, b'data')
+        result = pretty.rmtree('photos', workers=2, pool=self.pool)
+        self.assertEqual(result, (20, 21, []))
+        self.assertEqual(self.mfs.listdir('/'), [])
+
+        pretty.put(None, 'photos/nature/lake.log', b'lake')
+        pretty.put(None, 'photos/nature/keep.log', b'keep')
+        pretty.put(None, 'photos/other/a.txt', b'a')
+        delete = pretty.conn.delete
+
+        def refuse(path):
+            if path.endswith('keep.log'):
+                raise error_perm('550 Permission denied')
+            delete(path)
+        pretty.conn.delete = refuse
+        result = pretty.rmtree('/photos')
+        self.assertEqual(result.files, 2)
+        self.assertEqual(result.dirs, 1)
+        self.assertEqual(result.errors, [('/photos/nature/keep.log', '550 Permission denied')])
+        self.assertEqual(self.mfs.listdir('photos'), ['nature'])
+
+        result = pretty.rmtree('/missing')
+        self.assertEqual((result.files, result.dirs), (0, 0))
+        self.assertEqual([path for path, _ in result.errors], ['/missing'])
+
+    def test_batch(self):
+        pretty = self.factory()
+        pretty.cache = ListingCache()
+        for i in range(5):
+            self.mfs.writebytes('photos/%d.txt' % i, b'x' * i)
+        self.assertEqual(len(pretty.list('/photos')), 5)
+        batch = pretty.batch(window=4)
+        batch.size('/photos/3.txt').mdtm('/photos/3.txt').delete('/photos/0.txt')
+        batch.rename('/photos/1.txt', '/photos/one.txt').mkdir('/photos/nature')
+        batch.rename('/photos/missing.txt', '/photos/other.txt').delete('/photos/2.txt')
+        self.assertEqual(len(batch), 7)
+        pretty.conn.sock.writes = 0
+        results = batch.execute()
+        # 9 commands, 4 sent up front and then one as each reply comes in
+        self.assertEqual(pretty.conn.sock.writes, 6)
+        self.assertEqual(results[0], 3)
+        self.assertEqual(results[1].tzinfo, tzutc())
+        self.assertTrue(results[2].startswith('250'))
+        self.assertTrue(results[3].startswith('250'))
+        self.assertTrue(results[4].startswith('257'))
+        self.assertIsInstance(results[5], error_perm)
+        self.assertTrue(results[6].startswith('250'))
+        self.assertEqual(sorted(self.mfs.listdir('photos')),
+                         ['3.txt', '4.txt', 'nature', 'one.txt'])
+        self.assertEqual(sorted(pretty.list('/photos')), ['3.txt', '4.txt', 'nature', 'one.txt'])
+        self.assertEqual(len(batch), 0)
+
+        self.assertRaises(ValueError, pretty.batch().delete, 'a.txt\r\nDELE b.txt')
+        self.assertRaises(ValueError, pretty.batch, 0)
+
+    def test_batch_lockstep_fallback(self):
+        pretty = self.factory()
+        for i in range(5):
+            self.mfs.writebytes('photos/%d.txt' % i, b'x' * i)
+        pretty.conn.pipelining_supported = False
+        self.assertRaises(socket.timeout, pretty.batch().size('/photos/1.txt').size('/photos/2.txt').execute)
+
+        pretty.conn._replies = []
+        pretty.reconnect = lambda: True
+        batch = pretty.batch()
+        for i in range(5):
+            batch.size('/photos/%d.txt' % i)
+        self.assertEqual(batch.execute(), [0, 1, 2, 3, 4])
+        self.assertFalse(pretty.pipelining)
+        pretty.conn.sock.writes = 0
+        self.assertEqual(pretty.batch().size('/photos/4.txt').rename('/photos/4.txt', '/photos/5.txt').execute()[0], 4)
+        self.assertEqual(pretty.conn.sock.writes, 3)
+
+    def test_tree_stats(self):
+        pretty = self.factory()
+        self.mfs.writebytes('photos/a.txt', b'x' * 10)
+        self.mfs.makedirs('photos/nature/lakes')
+        self.mfs.makedirs('photos/empty')
+        self.mfs.writebytes('photos/nature/b.txt', b'x' * 20)
+        self.mfs.writebytes('photos/nature/lakes/c.txt', b'x' * 30)
+        self.mfs.writebytes('photos/nature/lakes/d.txt', b'x' * 5)
+
+        stats = pretty.tree_stats('/photos', top=2)
+        self.assertEqual((stats.size, stats.files, stats.dirs), (65, 4, 3))
+        self.assertEqual(stats.subtrees, {
+            '/photos/nature': (55, 3, 1),
+            '/photos/empty': (0, 0, 0),
+        })
+        self.assertEqual(stats.largest, [('/photos/nature/lakes/c.txt', 30),
+                                         ('/photos/nature/b.txt', 20)])
+        self.assertEqual(stats.errors, [])
+
+        stats = pretty.tree_stats('/photos', workers=2, pool=self.pool, depth=2)
+        self.assertEqual(stats.subtrees['/photos/nature/lakes'], (35, 2, 0))
+        self.assertEqual(len(stats.largest), 4)
+        self.assertEqual(pretty.du('/photos', workers=2, pool=self.pool), 65)
+        self.assertEqual(pretty.du('/photos/nature/lakes'), 35)
+
+        stats = pretty.tree_stats('/missing')
+        self.assertEqual([path for path, _ in stats.errors], ['/missing'])
+
+    def test_pool_requires_connect_args(self):
+        self.assertRaises(ValueError, self.factory().pool)
+
+    def test_close(self):
+        with self.pool.connection():
+            pass
+        self.pool.close()
+        self.assertTrue(self.created[0].conn.closed)
+        self.assertRaises(RuntimeError, self.pool.acquire)
+
+
 def suite():
     loader = unittest.TestLoader()
     suite = unittest.TestSuite()
     suite.addTest(loader.loadTestsFromTestCase(FtprettyTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(FtprettyPoolTestCase))
     return suite
 
 